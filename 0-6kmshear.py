@@ -1,19 +1,19 @@
-# Import necessary packages
+# Import necessary packages.  Only what every run needs is imported here:
+# matplotlib.pyplot and cartopy are loaded by maptemplate when the first map
+# is drawn, and wrf-python only where a function needs it, so a job that
+# diagnoses or draws a single timestep (e.g. sent to worker.py) starts quickly
 from netCDF4 import Dataset
-from wrf import getvar, interplevel, vinterp
 import numpy as np
-import matplotlib.pyplot as plt
 import matplotlib as mpl
-from metpy.plots.ctables import registry
 mpl.use("Agg")
-from matplotlib.cm import get_cmap
-import matplotlib.ticker as mticker
-import cartopy.crs as crs
-import cartopy.feature as cfeature
-from cartopy.feature import NaturalEarthFeature
-from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
-from wrf import (to_np, getvar, smooth2d, get_cartopy, cartopy_xlim,
-                 cartopy_ylim, latlon_coords, ll_to_xy, ALL_TIMES, interplevel)
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from wrfcache import cached
+from maptemplate import map_template, close_templates, domain_geometry
+from shear import bulk_shear, parse_layers
+from instrument import stage, summary, PROFILER
+import products
 
 # Create lists to loop through simulations
 dates = ['14_01','14_02','14_03','14_04','14_05','14_06','14_07','14_08','14_09','14_10','14_11','14_12','14_13','14_14','14_15', 
@@ -27,152 +27,169 @@ def addzero(value):
    
 interval = np.arange(10,85,5)   
 colormap = 'BuPu'
+layers = ((0., 6000.),) #(bottom, top) in m above ground, a bottom of 0 uses the 10m wind (--layers)
+extent = [-98.,-89.,45.,39.] #map extent (lon0, lon1, lat0, lat1)
+SHEAR_FIELDS = ("control_shear", "pert_shear", "diff_shear") #fields kept in the product store
    
-# Loop through the dates/simulations
-for date in dates:
-   ncfile1 = Dataset("/home/valang/Working/WRF_Project/WRF/test/em_real/wrf_control/wrfout_d01_2021-07-"+ date + ":00:00")
-   ncfile2 = Dataset("/home/valang/Working/WRF_Project/WRF/test/em_real/wrf_perturbed/wrfout_d01_2021-07-" + date + ":00:00")
-   
-   cont_u = getvar(ncfile1, "ua") #  get u
-   pert_u = getvar(ncfile2, "ua")
-   cont_v = getvar(ncfile1, "va") #  get v
-   pert_v = getvar(ncfile2, "va")
-   
-   cont_u10 = getvar(ncfile1, "U10") #  get u at surf
-   pert_u10 = getvar(ncfile2, "U10")
-   cont_v10 = getvar(ncfile1, "V10") #  get v at surf
-   pert_v10 = getvar(ncfile2, "V10")
-   
-   cont_z = getvar(ncfile1, "z") #get heights
-   pert_z = getvar(ncfile2, "z")
-   cont_terh = getvar(ncfile1,"ter", meta=False) #get terrain height
-   pert_terh = getvar(ncfile1,"ter", meta=False)
-   cont_pres = getvar(ncfile1, "pressure")  #get pressure
-   pert_pres = getvar(ncfile2, "pressure")
-   
-   cont_sixkm = cont_terh + 6000 #find 6km above terrain
-   pert_sixkm = pert_terh + 6000
-   
-   cont_u6km = interplevel(cont_u, cont_z, cont_sixkm) #interpolate to 6km wind
-   cont_v6km = interplevel(cont_v, cont_z, cont_sixkm)   
-   pert_u6km= interplevel(pert_u, cont_z, pert_sixkm)
-   pert_v6km = interplevel(pert_v, cont_z, pert_sixkm) 
-   
-   lats, lons = latlon_coords(cont_pres) #get lat/lons
-   cart_proj = get_cartopy(cont_pres)  #get projection 
-   
-   cont_shearu = cont_u6km - cont_u10  #find shear components
-   cont_shearv = cont_v6km - cont_v10
-   pert_shearu = pert_u6km - pert_u10
-   pert_shearv = pert_v6km - pert_v10 
-   
-   cont_shear = ((cont_shearu **2) + (cont_shearv **2))**0.5 #calc shear
-   pert_shear = ((pert_shearu **2) + (pert_shearv **2))**0.5
-   
+control_dir = "/home/valang/Working/WRF_Project/WRF/test/em_real/wrf_control/"
+perturbed_dir = "/home/valang/Working/WRF_Project/WRF/test/em_real/wrf_perturbed/"
+
+# "0-6km" for the layer (0., 6000.), used in the titles and file names
+def layer_label(layer):
+   return "%g-%gkm" % (layer[0] / 1000., layer[1] / 1000.)
+
+# Each layer is kept as its own product: "shear" for 0-6 km, as before, and
+# e.g. "shear_0-1km" for the others
+def product_name(layer):
+   return "shear" if tuple(layer) == (0., 6000.) else "shear_" + layer_label(layer)
+
+# The layer of a shear product, the inverse of product_name
+def product_layer(product):
+   if product == "shear":
+      return (0., 6000.)
+   return parse_layers(product[len("shear_"):-len("km")])[0]
+   
+# Plot control, perturbed and difference shear for a single date/simulation
+def plot_shear(date, raster=False, layers=layers):
+   plot_shear_files(control_dir + "wrfout_d01_2021-07-" + date + ":00:00",
+                    perturbed_dir + "wrfout_d01_2021-07-" + date + ":00:00",
+                    "2021-07-" + date + ":00:00", "2021-08-" + date + ":00:00", raster, layers=layers)
+
+# Plot the three shear panels for one control/perturbed pair of wrfout files;
+# valid is the valid time used in the titles and tag goes in the file names.
+# raster=True draws grid cells instead of filled contours, for animations,
+# and every layer in layers gets its own product and plots
+def plot_shear_files(control_path, perturbed_path, valid, tag, raster=False, region=None, layers=layers):
+   with stage("open"):
+      ncfile1 = Dataset(control_path)
+      ncfile2 = Dataset(perturbed_path)
+   
+   # Bulk shear of every layer straight from the raw U, V, PH/PHB, HGT and
+   # U10/V10, each read once, reusing the cached result when the wrfout file
+   # hasn't changed (the cache is keyed by the layers)
+   with stage("diagnose"):
+      cont_shears = cached(ncfile1, "bulk_shear", lambda: bulk_shear(ncfile1, layers), layers=layers)
+      pert_shears = cached(ncfile2, "bulk_shear", lambda: bulk_shear(ncfile2, layers), layers=layers)
+   
+   # Keep the fields in the product store, so they can be redrawn
+   # (render_products.py) without the wrfout files
+   with stage("store"):
+      for layer in layers:
+         cont_shear, pert_shear = cont_shears[layer], pert_shears[layer]
+         name = layer_label(layer).replace("km", " km")
+         products.write(product_name(layer), valid, {"control_shear": cont_shear, "pert_shear": pert_shear,
+                                                     "diff_shear": pert_shear - cont_shear},
+                        source=ncfile1, units=dict.fromkeys(SHEAR_FIELDS, "m s-1"),
+                        long_names={"control_shear": "control " + name + " bulk shear",
+                                    "pert_shear": "perturbed " + name + " bulk shear",
+                                    "diff_shear": "perturbed minus control " + name + " bulk shear"})
+   
+   # lat/lons, projection and map limits, worked out on the first date only
+   geometry = domain_geometry(ncfile1)
+   ncfile1.close()
+   ncfile2.close()
+   for layer in layers:
+      fields = dict(geometry, control_shear=cont_shears[layer], pert_shear=pert_shears[layer])
+      render_shear(fields, valid, tag, raster, region, layer)
+
+# Draw the three shear panels from a dict with the domain geometry
+# (lats, lons, cart_proj, xlim, ylim) and the control_shear/pert_shear fields.
+# region is a map extent (lon0, lon1, lat0, lat1) other than the default.
+# Layers other than 0-6 km get the layer in their file names
+def render_shear(fields, valid, tag, raster=False, region=None, layer=(0., 6000.)):
+   lats, lons = fields["lats"], fields["lons"]
+   cont_shear, pert_shear = fields["control_shear"], fields["pert_shear"]
+   lon0, lon1, lat0, lat1 = region or extent
+   label = layer_label(layer)
+   if tuple(layer) != (0., 6000.):
+      tag = label + "_" + tag
+   
+   # Map background (projection, boundaries, coastlines, states, gridlines) is
+   # built once per domain and shared by all three panels and every date
+   template = map_template(fields["cart_proj"], fields["xlim"], fields["ylim"],
+                           [lon0, lon1, lat0, lat1], np.arange(min(lon0, lon1), max(lon0, lon1), 2.),
+                           np.arange(min(lat0, lat1), max(lat0, lat1), 2.))
+
    # Plot control simulation shear
-   # Create a figure instanc and set up map projection, boundaries etc.
-   fig = plt.figure(figsize=(12,9), dpi=200.) 
-   ax = plt.axes(projection=cart_proj) 
-   #add coastlines to the plot (resolution, linewidth)
-   ax.coastlines('50m', linewidth = .8)
-        
-   #add the states
-   ax.add_feature(cfeature.STATES.with_scale('50m'),edgecolor = 'grey', linewidth = 0.6)
-      
-   # Set the map bounds
-   ax.set_xlim(cartopy_xlim(cont_pres))
-   ax.set_ylim(cartopy_ylim(cont_pres))
-
-   plt.contourf(to_np(lons), to_np(lats), to_np(cont_shear), np.arange(0.,62,2),
-            transform=crs.PlateCarree(), cmap=colormap, extend = 'both')
-   cb = plt.colorbar()
-   cb.set_label("0-6km Wind Shear (m/s)")
-   
-   ax.set_extent([-98.,-89.,45.,39.],crs=crs.PlateCarree())
-
-   gridlines = ax.gridlines(color="grey", linestyle="dotted", draw_labels=True)
-   gridlines.xlabels_top = False
-   gridlines.ylabels_right = False
-   gridlines.xlocator = mticker.FixedLocator(np.arange(-98.,-89.,2.))
-   gridlines.ylocator = mticker.FixedLocator(np.arange(39.,45.,2.))
-   gridlines.xlabel_style = {'size':8, 'color':'black'}
-   gridlines.ylabel_style = {'size':12, 'color':'black'}
-   gridlines.xformatter = LONGITUDE_FORMATTER
-   gridlines.yformatter = LATITUDE_FORMATTER
-       
-   plt.title("2021-07-" + date +":00:00 UTC Control Simulation 0-6km Shear", loc="left")
-   plt.savefig('control_shear_2021-08-' + date + ':00:00' + '.png')
-      
+   template.render(lons, lats, np.asarray(cont_shear), np.arange(0.,62,2),
+                   valid + " UTC Control Simulation " + label + " Shear",
+                   'control_shear_' + tag + '.png',
+                   cmap=colormap, cbar_label=label + " Wind Shear (m/s)", raster=raster)
+
    # Plot Perturbation simulation shear
-   # Create a figure instanc and set up map projection, boundaries etc.
-   fig = plt.figure(figsize=(12,9), dpi=200.)
-   ax = plt.axes(projection=cart_proj) 
-   #add coastlines to the plot (resolution, linewidth)
-   ax.coastlines('50m', linewidth = .8)
-        
-   #add the states
-   ax.add_feature(cfeature.STATES.with_scale('50m'),edgecolor = 'grey', linewidth = 0.6)
-      
-   # Set the map bounds
-   ax.set_xlim(cartopy_xlim(pert_pres))
-   ax.set_ylim(cartopy_ylim(pert_pres))
-
-   #Find difference in temperature between pert and cont simulation and plot contours every .25 degrees from -5 to 5C
-   #temp_diff = pert_rad - cont_rad
-   
-   plt.contourf(to_np(lons), to_np(lats), to_np(pert_shear), np.arange(0.,62,2), 
-            transform=crs.PlateCarree(), cmap=colormap, extend = 'both')
-   cb = plt.colorbar()
-   cb.set_label("0-6km Wind Shear (m/s)")
+   template.render(lons, lats, np.asarray(pert_shear), np.arange(0.,62,2),
+                   valid + " UTC Pertubation Simulation " + label + " Shear",
+                   'pert_shear_' + tag + '.png',
+                   cmap=colormap, cbar_label=label + " Wind Shear (m/s)", raster=raster)
 
-   ax.set_extent([-98.,-89.,45.,39.],crs=crs.PlateCarree())
-   
-   gridlines = ax.gridlines(color="grey", linestyle="dotted", draw_labels=True)
-   gridlines.xlabels_top = False
-   gridlines.ylabels_right = False
-   gridlines.xlocator = mticker.FixedLocator(np.arange(-98.,-89.,2.))
-   gridlines.ylocator = mticker.FixedLocator(np.arange(39.,45.,2.))
-   gridlines.xlabel_style = {'size':8, 'color':'black'}
-   gridlines.ylabel_style = {'size':12, 'color':'black'}
-   gridlines.xformatter = LONGITUDE_FORMATTER
-   gridlines.yformatter = LATITUDE_FORMATTER
-       
-   plt.title("2021-07-" + date +":00:00 UTC Pertubation Simulation 0-6km Shear", loc="left")
-   plt.savefig('pert_shear_2021-08-' + date + ':00:00' + '.png')
-   
-  # Plot perturbation minus control simulation shear (difference)
+   # Plot perturbation minus control simulation shear (difference)
    shear = pert_shear - cont_shear 
-   # Create a figure instanc and set up map projection, boundaries etc.
-   fig = plt.figure(figsize=(12,9), dpi=200.) 
-   ax = plt.axes(projection=cart_proj) 
-   #add coastlines to the plot (resolution, linewidth)
-   ax.coastlines('50m', linewidth = .8)
-        
-   #add the states
-   ax.add_feature(cfeature.STATES.with_scale('50m'),edgecolor = 'grey', linewidth = 0.6)
-      
-   # Set the map bounds
-   ax.set_xlim(cartopy_xlim(cont_pres))
-   ax.set_ylim(cartopy_ylim(cont_pres))
-
-   plt.contourf(to_np(lons), to_np(lats), to_np(cont_shear), np.arange(-30.,40,2),
-            transform=crs.PlateCarree(), cmap=colormap, extend = 'both')
-   cb = plt.colorbar()
-   cb.set_label("0-6km Wind Shear (m/s)")
-   
-   ax.set_extent([-98.,-89.,45.,39.],crs=crs.PlateCarree())
-
-   gridlines = ax.gridlines(color="grey", linestyle="dotted", draw_labels=True)
-   gridlines.xlabels_top = False
-   gridlines.ylabels_right = False
-   gridlines.xlocator = mticker.FixedLocator(np.arange(-98.,-89.,2.))
-   gridlines.ylocator = mticker.FixedLocator(np.arange(39.,45.,2.))
-   gridlines.xlabel_style = {'size':8, 'color':'black'}
-   gridlines.ylabel_style = {'size':12, 'color':'black'}
-   gridlines.xformatter = LONGITUDE_FORMATTER
-   gridlines.yformatter = LATITUDE_FORMATTER
-       
-   plt.title("2021-07-" + date +":00:00 UTC Pertubation Minus Control Simulation 0-6km Shear", loc="left")
-   plt.savefig('diff_shear_2021-08-' + date + ':00:00' + '.png')
+   template.render(lons, lats, np.asarray(shear), np.arange(-30.,40,2),
+                   valid + " UTC Pertubation Minus Control Simulation " + label + " Shear",
+                   'diff_shear_' + tag + '.png',
+                   cmap=colormap, cbar_label=label + " Wind Shear (m/s)", raster=raster)
 
-   
+
+# Run plot_shear for one date and hand back the error instead of raising it,
+# so one bad timestep doesn't take the rest of the batch down with it.  The
+# stage timings recorded for the date are handed back as well, so the parent
+# can summarise the whole batch
+def run_date(date, raster=False, layers=layers):
+   try:
+      with stage("plot", date=date):
+         plot_shear(date, raster, layers)
+   except Exception:
+      return date, traceback.format_exc(), PROFILER.drain()
+   return date, None, PROFILER.drain()
+
+# Each worker process sets up its own Agg backend; the Dataset handles are
+# opened inside plot_shear so nothing is shared between processes
+def init_worker():
+   mpl.use("Agg")
+
+# Loop through the dates/simulations, spreading them across worker processes
+# when workers > 1.  Returns the list of dates that failed.
+def run_dates(dates, workers=1, raster=False, layers=layers):
+   failed = []
+   if workers <= 1:
+      results = (run_date(date, raster, layers) for date in dates)
+   else:
+      pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+      futures = {pool.submit(run_date, date, raster, layers): date for date in dates}
+      results = (collect(future, futures[future]) for future in as_completed(futures))
+   for date, error, records in results:
+      PROFILER.records.extend(records)
+      if error is None:
+         print("finished " + date)
+      else:
+         print("FAILED " + date + "\n" + error)
+         failed.append(date)
+   if workers > 1:
+      pool.shutdown()
+   close_templates()
+   return failed
+
+# A worker that dies outright (e.g. a crash inside the netCDF library) shows up
+# as an exception on its future rather than a returned traceback
+def collect(future, date):
+   try:
+      return future.result()
+   except Exception:
+      return date, traceback.format_exc(), []
+
+if __name__ == "__main__":
+   parser = argparse.ArgumentParser(description="Plot 0-6km shear for the control and perturbed runs")
+   parser.add_argument("-j", "--workers", type=int, default=1,
+                       help="number of worker processes (default: 1, serial)")
+   parser.add_argument("--raster", action="store_true",
+                       help="draw grid cells instead of filled contours (faster, for animations)")
+   parser.add_argument("--layers", type=parse_layers, default=layers,
+                       help="shear layers in km above ground, e.g. 0-1,0-3,0-6 (default: 0-6)")
+   parser.add_argument("dates", nargs="*", default=dates,
+                       help="dates to plot as DD_HH (default: all)")
+   args = parser.parse_args()
+   failed = run_dates(args.dates, args.workers, args.raster, args.layers)
+   print(summary())
+   if failed:
+      print(str(len(failed)) + " of " + str(len(args.dates)) + " timesteps failed: " + ", ".join(failed))
+      raise SystemExit(1)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Vectorized finite-difference advection/diffusion on a periodic 1-D grid.
+#
+# This is the scheme from "Testing Numerical Instability.ipynb" and "Testing
+# Numerical Dampening .ipynb": a forward (Euler) start followed by leapfrog
+# advection with centred differences, plus a diffusion term lagged at the
+# previous time level,
+#
+#   h[n+1, j] = h[n-1, j] - (U dt / dx) (h[n, j+1] - h[n, j-1])
+#               + (K dt / dx**2) (h[n-1, j+1] + h[n-1, j-1] - 2 h[n-1, j])
+#
+# Instead of looping over grid points with special cases at j=0 and j=99, each
+# step updates the whole grid with array stencils, and any number of
+# configurations (U, dt, dx, K) can be advanced together as a batch.  Leading
+# dimensions of the initial state are the batch; the grid is the last axis.
+
+import numpy as np
+
+# Largest number of grid values held per state array while sweeping
+MAX_ELEMENTS = 2**22
+
+
+def gaussian(points, a=100., b=50., c=3.):
+    """Gaussian initial condition used in the notebooks."""
+    x = np.arange(points)
+    return a * np.exp(-(x - b)**2 / (2 * c**2))
+
+
+def centered_difference(h, out):
+    """out[j] = h[j+1] - h[j-1] with periodic boundaries."""
+    np.subtract(h[..., 2:], h[..., :-2], out=out[..., 1:-1])
+    out[..., 0] = h[..., 1] - h[..., -1]
+    out[..., -1] = h[..., 0] - h[..., -2]
+    return out
+
+
+def second_difference(h, out):
+    """out[j] = h[j+1] + h[j-1] - 2 h[j] with periodic boundaries."""
+    np.add(h[..., 2:], h[..., :-2], out=out[..., 1:-1])
+    out[..., 0] = h[..., 1] + h[..., -1]
+    out[..., -1] = h[..., 0] + h[..., -2]
+    out -= 2 * h
+    return out
+
+
+def column(value, batch_ndim):
+    """Shape a scalar or per-configuration parameter to broadcast over the grid."""
+    value = np.asarray(value, dtype=np.float64)
+    return value.reshape(value.shape + (1,) * (batch_ndim + 1 - value.ndim))
+
+
+def advect(h0, U, dt, dx, nsteps, K=0., forward_steps=1, save_every=None):
+    """Advance h0 by nsteps and return the final state or a saved history.
+
+    h0 is (..., points); U, dt, dx and K are scalars or arrays matching the
+    leading (batch) dimensions of h0.  The first forward_steps steps are
+    forward in time (the instability notebook used 2, the dampening notebook
+    1), the rest leapfrog.
+
+    With save_every=None only the final state (..., points) is returned.
+    Otherwise every save_every-th step, starting with the initial state, is
+    returned as (..., nsaved, points), so save_every=1 gives the full history
+    the notebooks kept in h[i, :].
+    """
+    h0 = np.asarray(h0, dtype=np.float64)
+    batch_ndim = h0.ndim - 1
+    courant = column(U, batch_ndim) * column(dt, batch_ndim) / column(dx, batch_ndim)
+    diffusion = column(K, batch_ndim) * column(dt, batch_ndim) / column(dx, batch_ndim)**2
+    has_diffusion = np.any(diffusion != 0)
+
+    history = None
+    if save_every is not None:
+        nsaved = nsteps // save_every + 1
+        history = np.empty(h0.shape[:-1] + (nsaved, h0.shape[-1]))
+        history[..., 0, :] = h0
+
+    prev = h0.copy()
+    curr = h0.copy()
+    nxt = np.empty_like(h0)
+    diff = np.empty_like(h0)
+    lap = np.empty_like(h0)
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        for n in range(nsteps):
+            centered_difference(curr, diff)
+            if n < forward_steps:
+                # forward step: h[n+1] = h[n] - C/2 dh + D d2h, all at level n
+                np.multiply(diff, -0.5 * courant, out=nxt)
+                nxt += curr
+                if has_diffusion:
+                    nxt += diffusion * second_difference(curr, lap)
+            else:
+                # leapfrog step, diffusion lagged at level n-1
+                np.multiply(diff, -courant, out=nxt)
+                nxt += prev
+                if has_diffusion:
+                    nxt += diffusion * second_difference(prev, lap)
+            prev, curr, nxt = curr, nxt, prev
+            if history is not None and (n + 1) % save_every == 0:
+                history[..., (n + 1) // save_every, :] = curr
+
+    return curr if history is None else history
+
+
+def parameter_grid(**axes):
+    """Cartesian product of parameter values.
+
+    Returns (shape, params) where params maps each name to a flat array with
+    one entry per configuration, and shape is the grid shape to reshape
+    results back to.
+    """
+    names = list(axes)
+    values = [np.atleast_1d(np.asarray(axes[name], dtype=np.float64)) for name in names]
+    mesh = np.meshgrid(*values, indexing="ij")
+    shape = mesh[0].shape if mesh else ()
+    return shape, {name: grid.ravel() for name, grid in zip(names, mesh)}
+
+
+def stability_sweep(U=10., dt=None, courant=None, K=0., dx=10000., points=100, nsteps=1000,
+                    forward_steps=1, initial=None):
+    """Run every combination of the given parameters and measure growth.
+
+    Any of U, dt (or courant, in which case dt = courant dx / U), K and dx may
+    be a sequence of values; all combinations are run as batches.  Returns
+    (params, growth) where growth is max|h| at the end over max|h| at the start,
+    shaped like the parameter grid.  growth > 1 marks an unstable
+    configuration; inf/nan mark ones that overflowed.
+    """
+    if (dt is None) == (courant is None):
+        raise ValueError("give exactly one of dt or courant")
+    axes = {"U": U, "K": K, "dx": dx}
+    axes["dt" if courant is None else "courant"] = dt if courant is None else courant
+    shape, params = parameter_grid(**axes)
+    if courant is not None:
+        params["dt"] = params["courant"] * params["dx"] / params["U"]
+
+    h0 = gaussian(points) if initial is None else np.asarray(initial, dtype=np.float64)
+    start = np.max(np.abs(h0))
+    nconfig = params["U"].size
+    chunk = max(1, MAX_ELEMENTS // h0.shape[-1])
+    growth = np.empty(nconfig)
+    for i in range(0, nconfig, chunk):
+        part = slice(i, min(i + chunk, nconfig))
+        batch = np.broadcast_to(h0, (part.stop - part.start, h0.shape[-1]))
+        final = advect(batch, params["U"][part], params["dt"][part], params["dx"][part], nsteps,
+                       K=params["K"][part], forward_steps=forward_steps)
+        with np.errstate(invalid="ignore"):
+            growth[part] = np.max(np.abs(final), axis=-1) / start
+
+    return ({name: value.reshape(shape) for name, value in params.items()},
+            growth.reshape(shape))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Streaming time-height area averages of perturbed minus control runs.
+#
+# Concatenating full 4-D arrays for every variable before averaging needs
+# memory proportional to the length of the run.  AreaAverager instead walks the
+# control/perturbed files one timestep at a time and keeps only what the
+# time-height plots need: one (bottom_top,) area-mean difference profile per
+# time and variable, and a running sum for the time-mean pressure profile.
+# Files are opened when they are reached and closed as soon as they have been
+# read, so peak memory is one timestep of the averaging box whatever the length
+# of the run.
+
+import bisect
+from contextlib import ExitStack
+
+import numpy as np
+from netCDF4 import Dataset
+
+from instrument import stage
+import products
+from wrfcache import cached
+from wrfwindow import window_getvar, extract_times
+
+# Variables averaged by default: temperature, cumulus potential temperature
+# tendency and cumulus water vapor mixing ratio tendency
+VARIABLES = ("tc", "RTHCUTEN", "RQVCUTEN")
+UNITS = {"tc": "degC", "RTHCUTEN": "K s-1", "RQVCUTEN": "kg kg-1 s-1", "pressure": "hPa"}
+
+
+class AreaAverager:
+    """Running area means of perturbed minus control over a grid window.
+
+    window is (x1, x2, y1, y2) as returned by wrfwindow.box_to_window and
+    label describes the box in plot titles, e.g. box_title(box).
+    """
+
+    def __init__(self, window, variables=VARIABLES, label=None):
+        self.window = tuple(window)
+        self.variables = tuple(variables)
+        self.label = label
+        self.times = []
+        self.profiles = {name: [] for name in self.variables}
+        self.p_sum = None
+        self.p_count = 0
+
+    def add_pair(self, control_path, perturbed_path):
+        """Add every time in one control/perturbed pair of wrfout files."""
+        times, profiles, p_sum, p_count = cached(
+            [control_path, perturbed_path], "areaavg",
+            lambda: self.read_pair(control_path, perturbed_path),
+            window=self.window, variables=self.variables)
+        # Keep the times in order even when a pair comes in late (e.g. a
+        # failed time retried with watch.py --retry-failed)
+        for i, t in enumerate(times):
+            index = bisect.bisect_right(self.times, t)
+            self.times.insert(index, t)
+            for name in self.variables:
+                self.profiles[name].insert(index, profiles[name][i])
+        self.p_sum = p_sum if self.p_sum is None else self.p_sum + p_sum
+        self.p_count += p_count
+
+    def read_pair(self, control_path, perturbed_path):
+        """Area-mean profiles for one file pair, read a timestep at a time."""
+        profiles = {name: [] for name in self.variables}
+        p_sum = None
+        with ExitStack() as files:
+            with stage("open", file=control_path):
+                control = files.enter_context(Dataset(control_path))
+                perturbed = files.enter_context(Dataset(perturbed_path))
+                times = list(extract_times(control))
+            for timeidx in range(len(times)):
+                with stage("average", time=times[timeidx]):
+                    for name in self.variables:
+                        diff = (window_getvar(perturbed, name, self.window, timeidx)
+                                - window_getvar(control, name, self.window, timeidx))
+                        profiles[name].append(diff[0].mean(axis=(1, 2)))
+                    # Pressure is taken from the control run, as the levels are
+                    # assumed to be nearly the same in both runs
+                    pres = window_getvar(control, "pressure", self.window, timeidx)[0].mean(axis=(1, 2))
+                    p_sum = pres if p_sum is None else p_sum + pres
+        return times, profiles, p_sum, len(times)
+
+    def add_pairs(self, control_paths, perturbed_paths):
+        for control_path, perturbed_path in zip(control_paths, perturbed_paths):
+            self.add_pair(control_path, perturbed_path)
+        return self
+
+    def mean(self, name):
+        """(Time, bottom_top) area-mean difference of one variable."""
+        return np.array(self.profiles[name])
+
+    def p_mean(self):
+        """Time and area mean control pressure profile (bottom_top,)."""
+        return self.p_sum / self.p_count
+
+    def time_values(self):
+        return np.array(self.times, dtype="datetime64[ns]")
+
+    def to_dict(self):
+        """The running state as plain lists, e.g. to keep in a JSON manifest."""
+        return {
+            "window": list(self.window),
+            "variables": list(self.variables),
+            "label": self.label,
+            "times": [str(np.datetime64(t, "ns")) for t in self.times],
+            "profiles": {name: [np.asarray(p).tolist() for p in self.profiles[name]]
+                         for name in self.variables},
+            "p_sum": None if self.p_sum is None else np.asarray(self.p_sum).tolist(),
+            "p_count": self.p_count,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """Rebuild an AreaAverager saved with to_dict, to carry on adding pairs."""
+        averager = cls(state["window"], state["variables"], state.get("label"))
+        averager.times = [np.datetime64(t, "ns") for t in state["times"]]
+        averager.profiles = {name: [np.array(p) for p in state["profiles"][name]]
+                             for name in averager.variables}
+        averager.p_sum = None if state["p_sum"] is None else np.array(state["p_sum"])
+        averager.p_count = state["p_count"]
+        return averager
+
+    def store(self, product=None):
+        """Write the time-height arrays and the mean pressure profile to the product store.
+
+        Each averaging window has its own product (product_name) unless one
+        is given, so averages over different boxes never share a series.
+        """
+        product = product or product_name(self.window)
+        valids = [str(np.datetime64(t, "s")).replace("T", "_") for t in self.times]
+        attrs = {"window": list(self.window), "p_count": self.p_count}
+        if self.label is not None:
+            attrs["label"] = self.label
+        products.write_times(product, valids, {name: self.mean(name) for name in self.variables},
+                             units=UNITS, attrs=attrs)
+        products.write_static(product, {"pressure": self.p_mean()}, units=UNITS)
+
+    @classmethod
+    def from_store(cls, product):
+        """Rebuild an AreaAverager from the product store, e.g. to redraw its plots."""
+        attrs = products.attributes(product)
+        fields = products.read(product)
+        variables = [name for name in VARIABLES if name in fields]
+        averager = cls(np.atleast_1d(attrs["window"]).tolist(), variables, attrs.get("label"))
+        averager.times = [np.datetime64(valid.replace("_", "T"), "ns") for valid in products.valid_times(product)]
+        averager.profiles = {name: list(fields[name]) for name in variables}
+        averager.p_count = int(attrs["p_count"])
+        averager.p_sum = fields["pressure"] * averager.p_count
+        return averager
+
+
+def product_name(window):
+    """Product store name of the area averages over a grid window."""
+    return "areaavg_%d_%d_%d_%d" % tuple(window)
+
+
+def box_title(box):
+    """Plot title text of a (lat1, lon1, lat2, lon2) averaging box."""
+    return "[(%s, %s) to (%s, %s)]" % tuple(box)
+
+
+def area_average(control_paths, perturbed_paths, window, variables=VARIABLES, label=None):
+    """Stream all file pairs through a new AreaAverager and return it."""
+    return AreaAverager(window, variables, label).add_pairs(control_paths, perturbed_paths)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Timing of the plotting pipelines on synthetic WRF output.
+#
+# For every grid size asked for, synthwrf writes a control and a perturbed run
+# into a scratch directory, and the stages the scripts go through are timed on
+# them:
+#
+#   open         open every control/perturbed file and read its Times
+#   diagnose     pressure and temperature (sim_diff_temps.py) and the 0-6 km
+#                bulk shear (0-6kmshear.py) over the whole domain
+#   interpolate  temperature on the pressure levels from 1000 to 100 hPa
+#   reduce       time-height area means of perturbed minus control over a box
+#                in the middle of the domain (sim_cross_section.py)
+#   render       one panel per time: filled contours on a plain axes or on the
+#                cartopy map template, the map template's raster path, or
+#                skipped
+#
+# Each stage reports its best time over --repeat runs, its throughput in
+# millions of grid columns per second and the bytes it read, so a regression or
+# a change in scaling between e.g. 100x100 and 1000x1000 shows up directly.
+# The stages are timed with instrument.py, so the nested stages the modules
+# record themselves (reduce/average, render/savefig ...) are in the --json
+# output too.  The disk cache is pointed at an empty scratch directory, so
+# every run measures real work.
+#
+# Example:
+#
+#   python benchmark.py --sizes 100x100 400x400 1000x1000 --times 3 --json bench.json
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from netCDF4 import Dataset
+
+import wrfcache
+from instrument import PROFILER, stage
+from synthwrf import Domain, write_run, WRF_TIME
+from wrfwindow import window_getvar, extract_times
+from shear import bulk_shear
+from areaavg import area_average
+from vinterp import VerticalInterpolator, PRESSURE_LEVELS
+
+STAGES = ("open", "diagnose", "interpolate", "reduce", "render")
+
+
+def parse_size(text):
+    """Parse "NXxNY" into (nx, ny)."""
+    nx, ny = text.lower().split("x")
+    return int(nx), int(ny)
+
+
+def central_window(domain, fraction=0.3):
+    """Grid window (x1, x2, y1, y2) covering the middle fraction of the domain."""
+    half_x = max(1, int(domain.nx * fraction / 2))
+    half_y = max(1, int(domain.ny * fraction / 2))
+    cx, cy = domain.nx // 2, domain.ny // 2
+    return (cx - half_x, cx + half_x - 1, cy - half_y, cy + half_y - 1)
+
+
+def map_projection(domain):
+    """cartopy projection and x/y limits of a synthetic domain, like wrf's get_cartopy."""
+    import cartopy.crs as crs
+
+    cart_proj = crs.LambertConformal(central_longitude=domain.cen_lon, central_latitude=domain.cen_lat,
+                                     standard_parallels=(domain.truelat1, domain.truelat2),
+                                     globe=crs.Globe(semimajor_axis=6370000, semiminor_axis=6370000))
+    half_x = (domain.nx - 1) / 2. * domain.dx
+    half_y = (domain.ny - 1) / 2. * domain.dx
+    return cart_proj, (-half_x, half_x), (-half_y, half_y)
+
+
+def open_stage(control_paths, perturbed_paths):
+    times = []
+    for path in control_paths + perturbed_paths:
+        with Dataset(path) as ncfile:
+            times.extend(extract_times(ncfile))
+    return times
+
+
+def diagnose_stage(control_paths):
+    fields = []
+    for path in control_paths:
+        with Dataset(path) as ncfile:
+            pres = window_getvar(ncfile, "pressure", None, 0)[0]
+            temp = window_getvar(ncfile, "tc", None, 0)[0]
+            shear = bulk_shear(ncfile)[(0., 6000.)]
+        fields.append((pres, temp, shear))
+    return fields
+
+
+def interpolate_stage(fields, levels=PRESSURE_LEVELS):
+    """Temperature on every pressure level; the 700 hPa one is rendered."""
+    panel = list(levels).index(700.)
+    return [VerticalInterpolator(pres, levels)(temp)[panel] for pres, temp, shear in fields]
+
+
+def reduce_stage(control_paths, perturbed_paths, window):
+    averages = area_average(control_paths, perturbed_paths, window)
+    return averages.mean("tc")
+
+
+def render_stage(domain, panels, mode, directory):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    lats, lons = domain.latlon()
+    levels = np.linspace(-10., 10., 21)
+    if mode in ("map", "raster"):
+        from maptemplate import map_template, close_templates
+        cart_proj, xlim, ylim = map_projection(domain)
+        extent = [float(lons.min()), float(lons.max()), float(lats.max()), float(lats.min())]
+        template = map_template(cart_proj, xlim, ylim, extent,
+                                np.arange(-180., 180., 5.), np.arange(-90., 90., 5.))
+        for i, data in enumerate(panels):
+            template.render(lons, lats, data, levels, "panel %d" % i,
+                            os.path.join(directory, "panel_%d.png" % i), raster=mode == "raster")
+        close_templates()
+    else:
+        fig, ax = plt.subplots(figsize=(12, 9), dpi=200.)
+        for i, data in enumerate(panels):
+            with stage("contourf"):
+                contours = ax.contourf(lons, lats, data, levels, extend="both")
+            with stage("savefig"):
+                fig.savefig(os.path.join(directory, "panel_%d.png" % i))
+            ax.clear()
+            del contours
+        plt.close(fig)
+
+
+def run_once(domain, control_paths, perturbed_paths, render, scratch):
+    """Run every stage once; returns the stage records, nested ones included."""
+    PROFILER.drain()
+    with stage("open"):
+        open_stage(control_paths, perturbed_paths)
+    with stage("diagnose"):
+        fields = diagnose_stage(control_paths)
+    with stage("interpolate"):
+        temps = interpolate_stage(fields)
+    with stage("reduce"):
+        reduce_stage(control_paths, perturbed_paths, central_window(domain))
+    if render != "none":
+        with stage("render"):
+            render_stage(domain, temps, render, scratch)
+    return PROFILER.drain()
+
+
+def benchmark_size(nx, ny, nz, ntimes, repeat, render, directory):
+    """Generate one synthetic run pair and time every stage on it."""
+    domain = Domain(nx, ny, nz)
+    start = datetime.strptime("2021-08-25_00:00:00", WRF_TIME)
+    begin = time.perf_counter()
+    control_paths = write_run(os.path.join(directory, "control"), domain, start, ntimes, seed=1)
+    perturbed_paths = write_run(os.path.join(directory, "perturbed"), domain, start, ntimes,
+                                seed=2, perturbation=1.)
+    generate = time.perf_counter() - begin
+
+    best = {}
+    records = []
+    for i in range(repeat):
+        # An empty cache for every run, so nothing is served from a previous one
+        wrfcache.set_cache(os.path.join(directory, "cache_%d" % i))
+        run = run_once(domain, control_paths, perturbed_paths, render, directory)
+        for record in run:
+            record["repeat"] = i
+        records.extend(run)
+        # Keep the whole record of the fastest run of each top-level stage
+        for record in run:
+            name = record["stage"]
+            if name in STAGES and (name not in best or record["seconds"] < best[name]["seconds"]):
+                best[name] = record
+
+    columns = nx * ny * ntimes
+    nbytes = sum(os.path.getsize(path) for path in control_paths + perturbed_paths)
+    return {
+        "size": "%dx%d" % (nx, ny), "nz": nz, "times": ntimes, "columns": columns,
+        "bytes": nbytes, "generate_seconds": generate,
+        "stages": {name: {"seconds": record["seconds"],
+                          "mcolumns_per_second": columns / record["seconds"] / 1e6,
+                          "bytes_read": record["bytes_read"], "peak_rss_mb": record["peak_rss_mb"]}
+                   for name, record in best.items()},
+        "records": records,
+    }
+
+
+def report(results):
+    print("%-11s %-12s %10s %14s %10s %9s" % ("size", "stage", "seconds", "Mcolumns/s", "MB read", "peak MB"))
+    for result in results:
+        print("%-11s %-12s %10.3f %14s   (%.1f MB on disk)" % (
+            result["size"], "generate", result["generate_seconds"], "", result["bytes"] / 1e6))
+        total = 0.
+        for name in STAGES:
+            if name not in result["stages"]:
+                continue
+            stats = result["stages"][name]
+            total += stats["seconds"]
+            print("%-11s %-12s %10.3f %14.3f %10.1f %9.1f" % (
+                result["size"], name, stats["seconds"], stats["mcolumns_per_second"],
+                (stats["bytes_read"] or 0) / 1e6, stats["peak_rss_mb"]))
+        print("%-11s %-12s %10.3f %14.3f" % (result["size"], "total", total, result["columns"] / total / 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the WRF plotting pipeline stages on synthetic output")
+    parser.add_argument("--sizes", nargs="+", default=["100x100"], help="grid sizes as NXxNY")
+    parser.add_argument("--nz", type=int, default=40, help="number of mass levels")
+    parser.add_argument("--times", type=int, default=3, help="number of output times per run")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per size, the best time is reported")
+    parser.add_argument("--render", choices=("plain", "map", "raster", "none"), default="plain",
+                        help="render on a plain axes, on the cartopy map template as contours or as a raster "
+                             "(both need Natural Earth data), or not at all")
+    parser.add_argument("--keep", metavar="DIR", help="write the synthetic files here and keep them")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        nx, ny = parse_size(size)
+        if args.keep:
+            directory = os.path.join(args.keep, size)
+            os.makedirs(directory, exist_ok=True)
+            results.append(benchmark_size(nx, ny, args.nz, args.times, args.repeat, args.render, directory))
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                results.append(benchmark_size(nx, ny, args.nz, args.times, args.repeat, args.render, directory))
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, default=str)
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Batched isentropic cross-sections along great-circle paths.
+#
+# "Plot Isentropic Cross-Section From NetCDF file.ipynb" gets one slice from
+# metpy's cross_section, which works out the path and interpolates every
+# variable of the dataset along it again for each call.  Here the work that
+# only depends on the path and the grid is done once:
+#
+#   * the points of every path, evenly spaced along the great circle on the
+#     WRF sphere, and their fractional grid indices (through the domain's map
+#     projection, in which WRF grids are regular);
+#   * the four surrounding grid points and bilinear weights of every point,
+#     with all the paths concatenated so one gather serves them all;
+#   * the bounding grid window of all the paths, so each time reads only that
+#     hyperslab (wrfwindow.py) instead of the whole domain;
+#   * the unit vectors along and across each path in grid coordinates, which
+#     turn the grid-relative u and v straight into tangential and normal
+#     winds (the WRF projections are conformal).
+#
+# Every later time is then one windowed read of P, PB, T, QVAPOR, U, V and PH
+# and a few gathers, whatever the number of paths, so an animation over a whole
+# run or a fan-out of dozens of paths costs about what one slice did.
+# Sections stay on the model levels, with the pressure of every point as
+# their vertical coordinate; VerticalInterpolator (vinterp.py) can put them
+# on pressure levels when fixed levels are wanted.
+#
+# Example, the notebook's path and a fan of 24 paths of 600 km around
+# Oklahoma City, for every time of a run:
+#
+#   python crosssection.py control/wrfout_d01_* --path 37.0 -105.0 35.5 -65.0 --fan 35.5 -97.5 600 24
+
+import argparse
+import os
+from collections import OrderedDict
+
+import numpy as np
+from netCDF4 import Dataset
+
+from instrument import stage, summary
+from maptemplate import MAX_TEMPLATES, domain_key
+from wrfwindow import extract_times, read_raw, window_getvar
+
+# Radius of the WRF sphere (m)
+EARTH_RADIUS = 6370000.
+MS_TO_KNOTS = 1.94384
+
+# Path of the notebook, (lat, lon) start to end
+PATH = ((37.0, -105.0), (35.5, -65.0))
+
+# Grid geometry of the domains seen in this process, keyed by maptemplate.domain_key,
+# and CrossSections built in this process, keyed by domain, paths and steps; both
+# least recently used first and bounded like the map templates
+DOMAINS = OrderedDict()
+INDICES = OrderedDict()
+
+
+def remember(cache, key, value):
+    """Store value in an LRU cache, dropping the least recently used entries past MAX_TEMPLATES."""
+    cache[key] = value
+    while len(cache) > max(MAX_TEMPLATES, 1):
+        cache.popitem(last=False)
+    return value
+
+
+def great_circle(start, end, steps=100):
+    """(lats, lons) of `steps` points evenly spaced along the great circle from start to end."""
+    lat1, lon1, lat2, lon2 = np.radians([start[0], start[1], end[0], end[1]])
+    a = np.array([np.cos(lat1) * np.cos(lon1), np.cos(lat1) * np.sin(lon1), np.sin(lat1)])
+    b = np.array([np.cos(lat2) * np.cos(lon2), np.cos(lat2) * np.sin(lon2), np.sin(lat2)])
+    angle = np.arccos(np.clip(a.dot(b), -1., 1.))
+    f = np.linspace(0., 1., steps)[:, np.newaxis]
+    if angle < 1e-12:
+        points = np.repeat(a[np.newaxis], steps, axis=0)
+    else:
+        points = (np.sin((1 - f) * angle) * a + np.sin(f * angle) * b) / np.sin(angle)
+    lats = np.degrees(np.arcsin(np.clip(points[:, 2], -1., 1.)))
+    lons = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+    return lats, lons
+
+
+def destination(lat, lon, bearing, distance):
+    """(lat, lon) reached going `distance` metres from (lat, lon) at `bearing` degrees."""
+    lat, lon, bearing = np.radians([lat, lon, bearing])
+    d = distance / EARTH_RADIUS
+    lat2 = np.arcsin(np.sin(lat) * np.cos(d) + np.cos(lat) * np.sin(d) * np.cos(bearing))
+    lon2 = lon + np.arctan2(np.sin(bearing) * np.sin(d) * np.cos(lat), np.cos(d) - np.sin(lat) * np.sin(lat2))
+    return float(np.degrees(lat2)), float((np.degrees(lon2) + 180.) % 360. - 180.)
+
+
+def fan(center, length, count):
+    """count paths of length km out of center, at evenly spaced bearings from north."""
+    return [(tuple(center), destination(center[0], center[1], bearing, length * 1000.))
+            for bearing in np.arange(count) * 360. / count]
+
+
+def grid_geometry(ncfile):
+    """Map projection, grid spacing and the projected (x, y) of grid point (0, 0)."""
+    key = domain_key(ncfile)
+    geometry = DOMAINS.get(key)
+    if geometry is not None:
+        DOMAINS.move_to_end(key)
+    else:
+        import cartopy.crs as crs
+        from products import projection
+
+        attrs = {name: ncfile.getncattr(name) for name in ncfile.ncattrs()}
+        cart_proj = projection(attrs)
+        lats = read_raw(ncfile, "XLAT", None, 0)[0][0]
+        lons = read_raw(ncfile, "XLONG", None, 0)[0][0]
+        origin = cart_proj.transform_point(float(lons[0, 0]), float(lats[0, 0]), crs.PlateCarree())
+        geometry = remember(DOMAINS, key, {"cart_proj": cart_proj, "origin": origin,
+                                           "dx": float(attrs["DX"]), "dy": float(attrs["DY"]),
+                                           "shape": lats.shape, "lats": lats, "lons": lons})
+    return geometry
+
+
+def fractional_index(geometry, lats, lons):
+    """Fractional (x, y) grid indices of lat/lon points on a grid_geometry domain."""
+    import cartopy.crs as crs
+
+    points = geometry["cart_proj"].transform_points(crs.PlateCarree(), np.asarray(lons, dtype=np.float64),
+                                                    np.asarray(lats, dtype=np.float64))
+    x0, y0 = geometry["origin"]
+    return (points[..., 0] - x0) / geometry["dx"], (points[..., 1] - y0) / geometry["dy"]
+
+
+class CrossSections:
+    """Interpolation index of a set of paths on one WRF domain.
+
+    paths is a list of ((lat, lon), (lat, lon)) start and end points, each
+    sampled at `steps` points along the great circle.  Built from any open
+    wrfout file of the domain and reused for every file and time of it.
+    Points off the domain come back as nan.
+    """
+
+    def __init__(self, ncfile, paths, steps=100):
+        self.paths = [(tuple(start), tuple(end)) for start, end in paths]
+        self.steps = steps
+        geometry = grid_geometry(ncfile)
+        ny, nx = geometry["shape"]
+
+        points = [great_circle(start, end, steps) for start, end in self.paths]
+        self.lats = np.array([lats for lats, lons in points])
+        self.lons = np.array([lons for lats, lons in points])
+        fx, fy = fractional_index(geometry, self.lats, self.lons)
+
+        # Distance along each path (km)
+        angle = np.arccos(np.clip(
+            np.sin(np.radians(self.lats[:, :1])) * np.sin(np.radians(self.lats))
+            + np.cos(np.radians(self.lats[:, :1])) * np.cos(np.radians(self.lats))
+            * np.cos(np.radians(self.lons - self.lons[:, :1])), -1., 1.))
+        self.distance = angle * EARTH_RADIUS / 1000.
+
+        # Unit vectors along the paths in grid coordinates, and across them
+        # (to the left, as metpy's cross_section_components)
+        tx = np.gradient(fx, axis=1)
+        ty = np.gradient(fy, axis=1)
+        norm = np.hypot(tx, ty)
+        norm[norm == 0] = 1.
+        self.tangent = (tx / norm, ty / norm)
+
+        inside = (fx >= 0) & (fx <= nx - 1) & (fy >= 0) & (fy <= ny - 1)
+        if not inside.any():
+            raise ValueError("no path crosses the domain")
+        # Smallest window holding every point and the grid points around it
+        self.window = (int(np.floor(fx[inside].min())), int(np.ceil(fx[inside].max())),
+                       int(np.floor(fy[inside].min())), int(np.ceil(fy[inside].max())))
+        x1, x2, y1, y2 = self.window
+        fx = np.clip(fx - x1, 0, x2 - x1)
+        fy = np.clip(fy - y1, 0, y2 - y1)
+        i = np.clip(np.floor(fx).astype(np.intp), 0, max(x2 - x1 - 1, 0))
+        j = np.clip(np.floor(fy).astype(np.intp), 0, max(y2 - y1 - 1, 0))
+        wx = fx - i
+        wy = fy - j
+        i1 = np.minimum(i + 1, x2 - x1)
+        j1 = np.minimum(j + 1, y2 - y1)
+        # All the paths' points in one row, for a single gather per corner
+        self.corners = [(j.ravel(), i.ravel()), (j.ravel(), i1.ravel()),
+                        (j1.ravel(), i.ravel()), (j1.ravel(), i1.ravel())]
+        weights = np.array([(1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx])
+        weights[:, ~inside] = np.nan
+        self.weights = weights.reshape(4, -1)
+
+    def interpolate(self, values):
+        """values (..., south_north, west_east) over the window, at every path point.
+
+        Returns (..., path, step).
+        """
+        values = np.asarray(values)
+        result = sum(values[..., j, i] * weight for (j, i), weight in zip(self.corners, self.weights))
+        return result.reshape(values.shape[:-2] + (len(self.paths), self.steps))
+
+    def read(self, ncfile, names, timeidx=0):
+        """window_getvar fields of one time interpolated onto the paths, all in one pass.
+
+        Returns {name: (path, ..., step)}.
+        """
+        fields = {name: window_getvar(ncfile, name, self.window, timeidx)[0] for name in names}
+        result = {}
+        groups = {}
+        for name, values in fields.items():
+            groups.setdefault(values.shape, []).append(name)
+        for names in groups.values():
+            stacked = np.moveaxis(self.interpolate(np.stack([fields[name] for name in names])), -2, 1)
+            for k, name in enumerate(names):
+                result[name] = stacked[k]
+        return result
+
+    def sections(self, ncfile, timeidx=0):
+        """Isentropic cross-sections of one time, one dict per path.
+
+        Each holds (bottom_top, step) arrays of pressure (hPa), theta (K),
+        rh (%), t_wind and n_wind (knots) and z (m), and (step,) lats, lons
+        and distance (km).
+        """
+        fields = self.read(ncfile, ["P", "PB", "T", "QVAPOR", "ua", "va", "z"], timeidx)
+        pres = fields["P"] + fields["PB"]
+        theta = fields["T"] + 300.
+        tk = theta * (pres / 100000.) ** (287. / 1004.5)
+        rh = relative_humidity(fields["QVAPOR"], pres, tk)
+        tx, ty = (component[:, np.newaxis] for component in self.tangent)
+        u, v = fields["ua"] * MS_TO_KNOTS, fields["va"] * MS_TO_KNOTS
+        t_wind = u * tx + v * ty
+        n_wind = v * tx - u * ty
+
+        return [{"pressure": pres[n] * 0.01, "theta": theta[n], "rh": rh[n], "t_wind": t_wind[n],
+                 "n_wind": n_wind[n], "z": fields["z"][n], "lats": self.lats[n], "lons": self.lons[n],
+                 "distance": self.distance[n]} for n in range(len(self.paths))]
+
+
+def relative_humidity(qv, pres, tk):
+    """Relative humidity (%) from the mixing ratio, pressure (Pa) and temperature (K), as wrf's rh."""
+    es = 611.2 * np.exp(17.67 * (tk - 273.15) / (tk - 29.65))
+    qvs = 0.622 * es / (pres - 0.378 * es)
+    return 100. * np.clip(qv / qvs, 0., 1.)
+
+
+def cross_sections(ncfile, paths, steps=100):
+    """The CrossSections index of paths on the domain of ncfile, built once per domain and paths."""
+    key = (domain_key(ncfile), tuple((tuple(start), tuple(end)) for start, end in paths), steps)
+    index = INDICES.get(key)
+    if index is not None:
+        INDICES.move_to_end(key)
+    else:
+        index = remember(INDICES, key, CrossSections(ncfile, paths, steps))
+    return index
+
+
+def run_sections(paths_in, paths, steps=100):
+    """Yield (valid, [section per path]) for every time of every wrfout file."""
+    for path in paths_in:
+        with Dataset(path) as ncfile:
+            index = cross_sections(ncfile, paths, steps)
+            for timeidx, valid in enumerate(extract_times(ncfile)):
+                valid = str(valid)[:19].replace("T", "_")
+                with stage("section", date=valid):
+                    sections = index.sections(ncfile, timeidx)
+                yield valid, sections
+
+
+def plot_section(section, start, end, valid, filename, geometry=None):
+    """Draw one cross-section like the notebook: rh, theta contours and wind barbs.
+
+    geometry (products.attrs_geometry) adds an inset map of the path.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    pres = section["pressure"]
+    # Along longitude as the notebook, or latitude for paths running more north-south
+    lons, lats = section["lons"], section["lats"]
+    by_lon = np.ptp(lons) >= np.ptp(lats)
+    x = np.broadcast_to(lons if by_lon else lats, pres.shape)
+    fig = plt.figure(figsize=(16., 9.))
+    ax = plt.axes()
+
+    # Plot RH using contourf
+    rh_contour = ax.contourf(x, pres, section["rh"], levels=np.arange(0, 105, 5), cmap="YlGnBu")
+    rh_colorbar = fig.colorbar(rh_contour)
+
+    # Potential temperature contours with labels
+    theta_contour = ax.contour(x, pres, section["theta"], levels=np.arange(250, 450, 5), colors="k",
+                               linewidths=2)
+    theta_contour.clabel(theta_contour.levels[1::2], fontsize=8, colors="k", inline=1,
+                         inline_spacing=8, fmt="%i", rightside_up=True)
+
+    # Every other model level and every fifth point, so the barbs don't crowd
+    barbs = (slice(0, None, 2), slice(5, None, 5))
+    ax.barbs(x[barbs], pres[barbs], section["t_wind"][barbs], section["n_wind"][barbs], color="k")
+
+    # Logarithmic pressure axis, 1000 to 100 hPa
+    ax.set_yscale("symlog")
+    ax.set_yticks(np.arange(1000, 50, -100))
+    ax.set_yticklabels(np.arange(1000, 50, -100))
+    ax.set_ylim(np.nanmax(pres), max(np.nanmin(pres), 100.))
+
+    if geometry is not None:
+        import cartopy.crs as crs
+        import featurecache
+
+        ax_inset = fig.add_axes([0.125, 0.665, 0.25, 0.25], projection=geometry["cart_proj"])
+        ax_inset.set_xlim(geometry["xlim"])
+        ax_inset.set_ylim(geometry["ylim"])
+        featurecache.add_feature(ax_inset, "coastline", "50m", linewidth=.8)
+        featurecache.add_feature(ax_inset, "states", "50m", edgecolor="k", alpha=0.2, zorder=0)
+        ax_inset.scatter([start[1], end[1]], [start[0], end[0]], c="k", zorder=2, transform=crs.PlateCarree())
+        ax_inset.plot(section["lons"], section["lats"], c="k", zorder=2, transform=crs.PlateCarree())
+
+    ax.set_title("WRF Cross-Section – ({:.2f}, {:.2f}) to ({:.2f}, {:.2f}) – Valid: {}\n"
+                 "Potential Temperature (K), Tangential/Normal Winds (knots), "
+                 "Relative Humidity (%)".format(start[0], start[1], end[0], end[1], valid))
+    ax.set_ylabel("Pressure (hPa)")
+    ax.set_xlabel("Longitude (degrees east)" if by_lon else "Latitude (degrees north)")
+    rh_colorbar.set_label("Relative Humidity (%)")
+
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Isentropic cross-sections along many paths and times")
+    parser.add_argument("wrfout", nargs="+", help="wrfout files, every time of each is drawn")
+    parser.add_argument("--path", type=float, nargs=4, action="append", metavar=("LAT1", "LON1", "LAT2", "LON2"),
+                        help="start and end of a path (repeat for more; default: the notebook's)")
+    parser.add_argument("--fan", type=float, nargs=4, metavar=("LAT", "LON", "KM", "N"),
+                        help="also N paths of KM km out of (LAT, LON)")
+    parser.add_argument("--steps", type=int, default=100, help="points along each path")
+    parser.add_argument("--no-inset", action="store_true", help="leave out the inset map of the path")
+    parser.add_argument("--out", default=".", help="directory for the plots")
+    args = parser.parse_args()
+
+    paths = [((lat1, lon1), (lat2, lon2)) for lat1, lon1, lat2, lon2 in args.path or []]
+    if args.fan is not None:
+        lat, lon, length, count = args.fan
+        paths += fan((lat, lon), length, int(count))
+    paths = paths or [PATH]
+
+    geometry = None
+    if not args.no_inset:
+        from products import attrs_geometry
+        with Dataset(args.wrfout[0]) as ncfile:
+            grid = grid_geometry(ncfile)
+            attrs = {name: ncfile.getncattr(name) for name in ncfile.ncattrs()}
+        geometry = attrs_geometry(attrs, grid["lats"], grid["lons"])
+
+    os.makedirs(args.out, exist_ok=True)
+    for valid, sections in run_sections(args.wrfout, paths, args.steps):
+        for n, ((start, end), section) in enumerate(zip(paths, sections)):
+            with stage("plot", date=valid):
+                plot_section(section, start, end, valid,
+                             os.path.join(args.out, "isentropic_%02d_%s.png" % (n, valid.replace(":", "_"))),
+                             geometry)
+
+    # Time spent in each stage (set WRF_PROFILE to also keep a JSON lines report)
+    print(summary())
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Ensemble statistics over N member runs.
+#
+# The scripts compare exactly two runs.  For a perturbed-physics ensemble the
+# same diagnostics are wanted for every member and summarised: the ensemble
+# mean, spread (standard deviation across members), minimum and maximum, and
+# each member minus the control run, for
+#
+#   * the 0-6 km bulk shear (shear.py),
+#   * the 700 hPa temperature (vinterp.py),
+#   * the area-averaged cumulus tendency profiles RTHCUTEN and RQVCUTEN.
+#
+# Members are matched to the control run by the valid time in their file
+# names.  The domain is cut into bands of rows and the bands are handed to
+# worker processes.  A worker reads one member's hyperslab of the band at a
+# time, reduces it to the 2-D diagnostics and folds those into running
+# (Welford) statistics before reading the next member, so neither a worker
+# nor the parent ever holds more than one member's 3-D fields of a band.  The
+# area averages only read the averaging box, one member per task.
+#
+# Example, 4 members against a control run on 8 cores:
+#
+#   python ensemble.py control/ member01/ member02/ member03/ member04/ -j 8
+#
+# The statistics go to ensemble.nc in the product store (products.py).
+
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from netCDF4 import Dataset
+
+from instrument import stage, summary
+import products
+from pairs import valid_time
+from shear import bulk_shear, LAYERS
+from vinterp import level_stack
+from wrfwindow import window_getvar
+
+FIELDS = ("shear", "t700")
+PROFILES = ("RTHCUTEN", "RQVCUTEN")
+
+# Default averaging box, as in sim_cross_section.py
+BOX = (32.0, -93.0, 36.0, -87.0)
+
+
+class RunningStats:
+    """Mean, spread, minimum and maximum of arrays added one at a time (Welford)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.n += 1
+        if self.mean is None:
+            self.mean = values.copy()
+            self.m2 = np.zeros_like(values)
+            self.min = values.copy()
+            self.max = values.copy()
+            return
+        delta = values - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (values - self.mean)
+        np.fmin(self.min, values, out=self.min)
+        np.fmax(self.max, values, out=self.max)
+
+    def spread(self):
+        """Sample standard deviation across the members added."""
+        if self.n < 2:
+            return np.zeros_like(self.mean)
+        return np.sqrt(self.m2 / (self.n - 1))
+
+    def result(self):
+        return {"mean": self.mean, "spread": self.spread(), "min": self.min, "max": self.max}
+
+
+def member_fields(path, window, timeidx=0):
+    """The 2-D ensemble diagnostics of one wrfout file over a grid window."""
+    with Dataset(path) as ncfile:
+        shear = bulk_shear(ncfile, LAYERS, timeidx, window)[LAYERS[0]]
+        t700 = level_stack([ncfile], ["tc"], [700.], timeidx=timeidx, window=window)["tc"][0, 0]
+    return {"shear": shear, "t700": t700}
+
+
+def chunk_stats(control_path, member_paths, window, timeidx=0):
+    """Statistics of every field over one window, reading one member at a time."""
+    control = member_fields(control_path, window, timeidx)
+    stats = {name: RunningStats() for name in FIELDS}
+    diffs = {name: [] for name in FIELDS}
+    for path in member_paths:
+        fields = member_fields(path, window, timeidx)
+        for name in FIELDS:
+            stats[name].add(fields[name])
+            diffs[name].append((fields[name] - control[name]).astype(np.float32))
+    result = {}
+    for name in FIELDS:
+        result[name] = stats[name].result()
+        result[name]["control"] = control[name]
+        result[name]["minus_control"] = np.array(diffs[name])
+    return window, result
+
+
+def member_profiles(path, window, variables=PROFILES, timeidx=0):
+    """Area-mean profiles (bottom_top,) of each variable over the window."""
+    with Dataset(path) as ncfile:
+        return {name: window_getvar(ncfile, name, window, timeidx)[0].mean(axis=(1, 2))
+                for name in variables}
+
+
+def row_windows(ny, nx, rows):
+    """Split the domain into windows (x1, x2, y1, y2) of `rows` rows each."""
+    return [(0, nx - 1, y1, min(y1 + rows, ny) - 1) for y1 in range(0, ny, rows)]
+
+
+def match_members(control_dir, member_dirs, pattern="wrfout_d01_*"):
+    """[(valid, control path, [member paths]), ...] for the times every run has."""
+    def by_time(directory):
+        return {valid_time(path): path for path in glob.glob(os.path.join(directory, pattern))}
+
+    control = by_time(control_dir)
+    members = [by_time(directory) for directory in member_dirs]
+    return [(valid, control[valid], [member[valid] for member in members])
+            for valid in sorted(control) if all(valid in member for member in members)]
+
+
+def ensemble_time(pool, control_path, member_paths, box_window, rows=None, workers=1):
+    """Ensemble statistics of one valid time, the bands spread over pool.
+
+    box_window is the grid window of the area averages.  Returns {field:
+    {"mean", "spread", "min", "max", "control", "minus_control"}} for the 2-D
+    fields and the same for each area-averaged profile.
+    """
+    with Dataset(control_path) as ncfile:
+        ny = len(ncfile.dimensions["south_north"])
+        nx = len(ncfile.dimensions["west_east"])
+    if rows is None:
+        # a couple of bands per worker keeps every core busy to the end
+        rows = max(1, -(-ny // (2 * workers)))
+
+    bands = [pool.submit(chunk_stats, control_path, member_paths, window)
+             for window in row_windows(ny, nx, rows)]
+    profiles = [pool.submit(member_profiles, path, box_window)
+                for path in [control_path] + list(member_paths)]
+
+    result = {}
+    for name in FIELDS:
+        result[name] = {key: np.empty((ny, nx)) for key in ("mean", "spread", "min", "max", "control")}
+        result[name]["minus_control"] = np.empty((len(member_paths), ny, nx), dtype=np.float32)
+    for future in bands:
+        (x1, x2, y1, y2), band = future.result()
+        for name in FIELDS:
+            for key, values in band[name].items():
+                result[name][key][..., y1:y2 + 1, x1:x2 + 1] = values
+
+    control = profiles[0].result()
+    stats = {name: RunningStats() for name in PROFILES}
+    diffs = {name: [] for name in PROFILES}
+    for future in profiles[1:]:
+        member = future.result()
+        for name in PROFILES:
+            stats[name].add(member[name])
+            diffs[name].append(member[name] - control[name])
+    for name in PROFILES:
+        result[name] = stats[name].result()
+        result[name]["control"] = control[name]
+        result[name]["minus_control"] = np.array(diffs[name])
+    return result
+
+
+def run_ensemble(control_dir, member_dirs, box_window, workers=None, rows=None, pattern="wrfout_d01_*"):
+    """Yield (valid, ensemble_time result) for every valid time all runs have."""
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for valid, control_path, member_paths in match_members(control_dir, member_dirs, pattern):
+            yield valid, ensemble_time(pool, control_path, member_paths, box_window, rows, workers)
+
+
+def store(valid, result, control_path, product="ensemble"):
+    """Write one time's statistics to the product store, as fields like shear_mean."""
+    fields = {}
+    for name, stats in result.items():
+        for key, values in stats.items():
+            fields[name + "_" + key] = values
+    units = {}
+    for name, unit in (("shear", "m s-1"), ("t700", "degC"), ("RTHCUTEN", "K s-1"), ("RQVCUTEN", "kg kg-1 s-1")):
+        units.update(dict.fromkeys([field for field in fields if field.startswith(name + "_")], unit))
+    with Dataset(control_path) as ncfile:
+        products.write(product, valid, fields, source=ncfile, units=units)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ensemble mean/spread/min/max and member minus control statistics")
+    parser.add_argument("control_dir", help="directory of the control run")
+    parser.add_argument("member_dirs", nargs="+", help="directories of the ensemble members")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--rows", type=int, help="rows per band (default: two bands per worker)")
+    parser.add_argument("--pattern", default="wrfout_d01_*", help="wrfout file name pattern")
+    parser.add_argument("--box", type=float, nargs=4, default=BOX,
+                        metavar=("LAT1", "LON1", "LAT2", "LON2"), help="area averaging box")
+    parser.add_argument("--window", type=int, nargs=4, metavar=("X1", "X2", "Y1", "Y2"),
+                        help="area averaging box as grid indices instead of --box")
+    parser.add_argument("--store", help="product store directory (default: WRF_PRODUCTS or ./products)")
+    args = parser.parse_args()
+
+    if args.window is not None:
+        box_window = tuple(args.window)
+    else:
+        from wrfwindow import box_to_window
+        control_path = match_members(args.control_dir, args.member_dirs, args.pattern)[0][1]
+        with Dataset(control_path) as ncfile:
+            box_window = box_to_window(ncfile, *args.box)
+
+    if args.store is not None:
+        products.set_store(args.store)
+    members = {valid: control_path for valid, control_path, _ in
+               match_members(args.control_dir, args.member_dirs, args.pattern)}
+    for valid, result in run_ensemble(args.control_dir, args.member_dirs, box_window,
+                                      args.workers, args.rows, args.pattern):
+        with stage("store", date=valid):
+            store(valid, result, members[valid])
+        print("%s  shear spread %.2f m/s  t700 spread %.2f C" % (
+            valid, np.nanmean(result["shear"]["spread"]), np.nanmean(result["t700"]["spread"])))
+    print(summary())
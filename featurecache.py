@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Offline cache of the Natural Earth map features, clipped and projected.
+#
+# ax.coastlines('50m') and add_feature(cfeature.STATES...) hand cartopy the
+# full-globe Natural Earth geometries, which it reads, projects and clips
+# again for every figure, and on a machine without the shapefiles it tries to
+# download them, which fails on the compute nodes.  This module reads the
+# shapefiles from a local Natural Earth directory only (NATURAL_EARTH_DIR,
+# laid out as cartopy keeps them: <category>/ne_<scale>_<name>.shp), keeps
+# the parts that fall inside a map view, projects them into the map projection
+# once and stores the result as ready-made matplotlib paths in a cache
+# directory (FEATURE_CACHE_DIR).  Drawing a feature on a figure is then a
+# pickle load and one collection in native map coordinates.
+#
+# The cache is keyed by the feature, the scale, the projection and the view,
+# and the shapefile's modification time, so it can be built on one machine
+# and copied to the nodes together with the shapefiles, e.g. for the domain of
+# a wrfout file:
+#
+#   python featurecache.py wrfout_d01_2021-07-14_01:00:00 --extent -98 -89 45 39 --features coastline states
+#
+# where --extent is the map extent the plotting script sets on that domain.
+#
+# stock_img() is cached the same way, as cartopy's bundled background image
+# warped into the view once.
+#
+# Only the MAX_LOADED most recently used features are kept in memory, so a
+# long-lived process drawing many different views (worker.py) doesn't hold
+# every view it has ever drawn; the others are reloaded from the cache files.
+
+import argparse
+import hashlib
+import gzip
+import os
+import pickle
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from wrfcache import store
+
+NATURAL_EARTH_DIR = os.environ.get(
+    "NATURAL_EARTH_DIR",
+    os.path.join(os.path.expanduser("~"), ".local", "share", "cartopy", "shapefiles", "natural_earth"))
+CACHE_DIR = os.environ.get("FEATURE_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "featurecache"))
+SUFFIX = ".pkl.gz"
+
+# name: (category, Natural Earth name, kind, default style)
+FEATURES = {
+    "coastline": ("physical", "coastline", "line", {"edgecolor": "black"}),
+    "states": ("cultural", "admin_1_states_provinces_lakes", "polygon",
+               {"edgecolor": "grey", "facecolor": "none"}),
+    "state_lines": ("cultural", "admin_1_states_provinces_lines", "line", {"edgecolor": "grey"}),
+    "borders": ("cultural", "admin_0_boundary_lines_land", "line", {"edgecolor": "black"}),
+    "lakes": ("physical", "lakes", "polygon", {"edgecolor": "none", "facecolor": "#97b6e1"}),
+    "rivers": ("physical", "rivers_lake_centerlines", "line", {"edgecolor": "#97b6e1"}),
+    "land": ("physical", "land", "polygon", {"edgecolor": "none", "facecolor": "#efefdb"}),
+    "ocean": ("physical", "ocean", "polygon", {"edgecolor": "none", "facecolor": "#97b6e1"}),
+}
+
+# Features already loaded in this process, keyed like the files, least
+# recently used first; a few features per map template
+LOADED = OrderedDict()
+MAX_LOADED = 4 * int(os.environ.get("WRF_MAX_TEMPLATES", 8))
+
+# Missing shapefiles already warned about
+MISSING = set()
+
+
+def set_cache(directory=None, natural_earth_dir=None):
+    """Change the cache and/or the Natural Earth directory for this process."""
+    global CACHE_DIR, NATURAL_EARTH_DIR
+    if directory is not None:
+        CACHE_DIR = directory
+    if natural_earth_dir is not None:
+        NATURAL_EARTH_DIR = natural_earth_dir
+
+
+def shapefile_path(name, scale):
+    category, ne_name = FEATURES[name][:2]
+    return os.path.join(NATURAL_EARTH_DIR, category, "ne_%s_%s.shp" % (scale, ne_name))
+
+
+def stock_image_path():
+    import cartopy
+    return os.path.join(str(cartopy.config["repo_data_dir"]), "raster", "natural_earth",
+                        "50-natural-earth-1-downsampled.png")
+
+
+def view_key(cart_proj, xlim, ylim):
+    """The projection and view, rounded to a metre so float noise doesn't miss the cache."""
+    return (cart_proj.proj4_init, tuple(np.round(np.asarray(xlim, dtype=np.float64))),
+            tuple(np.round(np.asarray(ylim, dtype=np.float64))))
+
+
+def cache_key(name, scale, source, cart_proj, xlim, ylim):
+    try:
+        mtime = os.stat(source).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    parts = [name, scale, source, repr(mtime), repr(view_key(cart_proj, xlim, ylim))]
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def padded(xlim, ylim, pad=0.05):
+    """xlim, ylim widened by pad of their span on every side."""
+    dx = pad * abs(xlim[1] - xlim[0])
+    dy = pad * abs(ylim[1] - ylim[0])
+    return (min(xlim) - dx, max(xlim) + dx), (min(ylim) - dy, max(ylim) + dy)
+
+
+def lonlat_bounds(cart_proj, xlim, ylim, samples=50):
+    """(lon0, lat0, lon1, lat1) enclosing the view, from points along its edges."""
+    import cartopy.crs as crs
+
+    xs = np.linspace(xlim[0], xlim[1], samples)
+    ys = np.linspace(ylim[0], ylim[1], samples)
+    x = np.concatenate([xs, xs, np.full(samples, xlim[0]), np.full(samples, xlim[1])])
+    y = np.concatenate([np.full(samples, ylim[0]), np.full(samples, ylim[1]), ys, ys])
+    points = crs.PlateCarree().transform_points(cart_proj, x, y)
+    lons, lats = points[:, 0], points[:, 1]
+    ok = np.isfinite(lons) & np.isfinite(lats)
+    return (lons[ok].min() - 1., max(lats[ok].min() - 1., -90.),
+            lons[ok].max() + 1., min(lats[ok].max() + 1., 90.))
+
+
+def geometry_paths(geometry, polygon):
+    """matplotlib Paths of a projected shapely geometry, one per polygon or line."""
+    from matplotlib.path import Path
+
+    if geometry.is_empty:
+        return []
+    if hasattr(geometry, "geoms"):
+        paths = []
+        for part in geometry.geoms:
+            paths.extend(geometry_paths(part, polygon))
+        return paths
+    if geometry.geom_type == "Polygon":
+        if not polygon:
+            # outline only: each ring as a line
+            return [Path(np.asarray(ring.coords)[:, :2]) for ring in [geometry.exterior] + list(geometry.interiors)]
+        vertices, codes = [], []
+        for ring in [geometry.exterior] + list(geometry.interiors):
+            coords = np.asarray(ring.coords)[:, :2]
+            ring_codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+            ring_codes[0] = Path.MOVETO
+            ring_codes[-1] = Path.CLOSEPOLY
+            vertices.append(coords)
+            codes.append(ring_codes)
+        return [Path(np.concatenate(vertices), np.concatenate(codes))]
+    if geometry.geom_type in ("LineString", "LinearRing"):
+        return [Path(np.asarray(geometry.coords)[:, :2])]
+    return []
+
+
+def build(name, scale, cart_proj, xlim, ylim):
+    """Read, clip and project one feature from its local shapefile.
+
+    Returns [(vertices, codes), ...] in map coordinates, codes None for lines.
+    """
+    import cartopy.crs as crs
+    import shapely.geometry as sgeom
+    from cartopy.io.shapereader import Reader
+
+    kind = FEATURES[name][2]
+    lon0, lat0, lon1, lat1 = lonlat_bounds(cart_proj, *padded(xlim, ylim))
+    xclip, yclip = padded(xlim, ylim)
+    clip = sgeom.box(xclip[0], yclip[0], xclip[1], yclip[1])
+    source = crs.PlateCarree()
+    paths = []
+    reader = Reader(shapefile_path(name, scale))
+    try:
+        for geometry in reader.geometries():
+            if geometry is None:
+                continue
+            gx0, gy0, gx1, gy1 = geometry.bounds
+            if gx1 < lon0 or gx0 > lon1 or gy1 < lat0 or gy0 > lat1:
+                continue
+            projected = cart_proj.project_geometry(geometry, source)
+            projected = projected.intersection(clip)
+            for path in geometry_paths(projected, kind == "polygon"):
+                paths.append((path.vertices, path.codes))
+    finally:
+        if hasattr(reader, "close"):
+            reader.close()
+    return paths
+
+
+def build_stock(cart_proj, xlim, ylim, resolution=750):
+    """cartopy's stock background image warped into the view: (image, extent)."""
+    import cartopy.crs as crs
+    import matplotlib.pyplot as plt
+    from cartopy.img_transform import warp_array
+
+    image = plt.imread(stock_image_path())
+    target_extent = (xlim[0], xlim[1], ylim[0], ylim[1])
+    aspect = abs((ylim[1] - ylim[0]) / (xlim[1] - xlim[0]))
+    warped, extent = warp_array(image[::-1], cart_proj, crs.PlateCarree(),
+                                (resolution, max(1, int(resolution * aspect))),
+                                source_extent=(-180, 180, -90, 90), target_extent=target_extent)
+    return np.ma.filled(warped, 0), extent
+
+
+def load(name, scale, cart_proj, xlim, ylim):
+    """Clipped, projected paths of a feature (or the stock image), built on first use.
+
+    Returns None when the shapefile is missing: nothing is downloaded.
+    """
+    source = stock_image_path() if name == "stock" else shapefile_path(name, scale)
+    key = cache_key(name, scale, source, cart_proj, xlim, ylim)
+    value = LOADED.get(key)
+    if value is not None:
+        LOADED.move_to_end(key)
+        return value
+    path = os.path.join(CACHE_DIR, key + SUFFIX)
+    try:
+        with gzip.open(path, "rb") as f:
+            value = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        if not os.path.exists(source):
+            if source not in MISSING:
+                MISSING.add(source)
+                warnings.warn("no shapefile for %s at %s (set NATURAL_EARTH_DIR); left off the map"
+                              % (name, source))
+            return None
+        value = build_stock(cart_proj, xlim, ylim) if name == "stock" else build(name, scale, cart_proj, xlim, ylim)
+        store(path, value)
+    LOADED[key] = value
+    while len(LOADED) > max(MAX_LOADED, 1):
+        LOADED.popitem(last=False)
+    return value
+
+
+def add_feature(ax, name, scale="50m", xlim=None, ylim=None, **style):
+    """Draw a cached feature on a cartopy GeoAxes, in its native coordinates.
+
+    xlim/ylim default to the current view of ax; style overrides the
+    feature's default colours (edgecolor, facecolor, linewidth, ...).
+    """
+    from matplotlib.collections import PathCollection
+    from matplotlib.path import Path
+
+    xlim = ax.get_xlim() if xlim is None else xlim
+    ylim = ax.get_ylim() if ylim is None else ylim
+    value = load(name, scale, ax.projection, xlim, ylim)
+    if value is None:
+        return None
+    if name == "stock":
+        image, extent = value
+        artist = ax.imshow(image, origin="lower", extent=extent, zorder=style.pop("zorder", 0), **style)
+    else:
+        kwargs = dict(FEATURES[name][3])
+        kwargs.update(style)
+        if FEATURES[name][2] == "line":
+            kwargs["facecolor"] = "none"
+        kwargs.setdefault("zorder", 1.5)  # above the filled contours, as cartopy's features
+        artist = PathCollection([Path(vertices, codes) for vertices, codes in value],
+                                transform=ax.transData, **kwargs)
+        ax.add_collection(artist, autolim=False)
+    # adding artists must not move the map view
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    return artist
+
+
+def prepare(cart_proj, xlim, ylim, names, scale="50m"):
+    """Build the cache entries of several features for one view, e.g. before going offline."""
+    return {name: load(name, scale, cart_proj, xlim, ylim) is not None for name in names}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the clipped, projected map features for a WRF domain")
+    parser.add_argument("wrfout", help="wrfout file of the domain")
+    parser.add_argument("--extent", type=float, nargs=4, metavar=("LON0", "LON1", "LAT0", "LAT1"),
+                        help="map extent set on the domain, as in the plotting scripts (default: whole domain)")
+    parser.add_argument("--features", nargs="+", default=["coastline", "states"],
+                        choices=sorted(FEATURES) + ["stock"])
+    parser.add_argument("--scale", default="50m", choices=["10m", "50m", "110m"])
+    parser.add_argument("--natural-earth", help="Natural Earth shapefile directory (default: NATURAL_EARTH_DIR)")
+    parser.add_argument("--cache", help="cache directory (default: FEATURE_CACHE_DIR)")
+    args = parser.parse_args()
+
+    from netCDF4 import Dataset
+    from wrfwindow import read_raw
+    from products import attrs_geometry
+
+    set_cache(args.cache, args.natural_earth)
+    with Dataset(args.wrfout) as ncfile:
+        attrs = {name: ncfile.getncattr(name) for name in ncfile.ncattrs()}
+        lats = read_raw(ncfile, "XLAT", None, 0)[0][0]
+        lons = read_raw(ncfile, "XLONG", None, 0)[0][0]
+    geometry = attrs_geometry(attrs, lats, lons)
+
+    # Work out the view the way MapTemplate does: domain limits, then the extent
+    import cartopy.crs as crs
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    ax = plt.figure().add_subplot(1, 1, 1, projection=geometry["cart_proj"])
+    ax.set_xlim(geometry["xlim"])
+    ax.set_ylim(geometry["ylim"])
+    if args.extent is not None:
+        ax.set_extent(args.extent, crs=crs.PlateCarree())
+    built = prepare(geometry["cart_proj"], ax.get_xlim(), ax.get_ylim(), args.features, args.scale)
+    for name, ok in built.items():
+        print("%-12s %s" % (name, "cached" if ok else "missing shapefile"))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Per-stage timing of the plotting pipelines.
+#
+# A Profiler records, for every stage a script wraps in `with stage(...)`, the
+# wall time, the bytes the process read while in it (rchar from
+# /proc/self/io, so page-cache hits count too) and the process peak RSS when it
+# ended.  Stages nest, and get names like "render/savefig"; keyword tags (the
+# date, the timestep) are kept with each record and inherited by the stages
+# nested inside.  Nesting is tracked per thread, so a stage running on a
+# prefetch thread is not filed under whatever the main thread is doing.  The
+# bookkeeping is a perf_counter call, one small /proc read and a getrusage call
+# per stage, so it is cheap enough to leave on.
+#
+# Records are kept in memory for the summary table the scripts print at the
+# end, and are also appended to a JSON lines report when one is configured
+# with the WRF_PROFILE environment variable (or set_report()).  An existing
+# report can be summarised again with
+#
+#   python instrument.py profile.jsonl
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+REPORT = os.environ.get("WRF_PROFILE")
+
+
+def bytes_read():
+    """Bytes read by this process so far, or None where /proc/self/io is missing."""
+    try:
+        with open("/proc/self/io", "rb") as f:
+            for line in f:
+                if line.startswith(b"rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (MB)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    return peak / 1024.**2 if sys.platform == "darwin" else peak / 1024.
+
+
+class Profiler:
+    """Collects stage records and optionally appends them to a JSON lines file."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.file = None
+        self.pid = None
+
+    def stack(self):
+        """(names, tags) of the stages open in the calling thread."""
+        if not hasattr(self.local, "names"):
+            self.local.names = []
+            self.local.tags = []
+        return self.local.names, self.local.tags
+
+    @contextmanager
+    def stage(self, name, **tags):
+        """Time the enclosed block as stage `name` (nested under any open stage)."""
+        names, stack_tags = self.stack()
+        names.append(name)
+        stack_tags.append(tags)
+        start_bytes = bytes_read()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            end_bytes = bytes_read()
+            record = {"stage": "/".join(names)}
+            for level in stack_tags:
+                record.update(level)
+            record["seconds"] = seconds
+            record["bytes_read"] = None if start_bytes is None else end_bytes - start_bytes
+            record["peak_rss_mb"] = peak_rss_mb()
+            record["pid"] = os.getpid()
+            names.pop()
+            stack_tags.pop()
+            self.add([record])
+
+    def add(self, records):
+        """Keep records (e.g. ones sent back by a worker process) and write them out."""
+        with self.lock:
+            self.records.extend(records)
+            if self.path is None:
+                return
+            # A worker forked from this process opens its own handle
+            if self.file is None or self.pid != os.getpid():
+                self.file = open(self.path, "a")
+                self.pid = os.getpid()
+            for record in records:
+                self.file.write(json.dumps(record, default=str) + "\n")
+            self.file.flush()
+
+    def drain(self):
+        """Return the records kept so far and forget them."""
+        with self.lock:
+            records, self.records = self.records, []
+        return records
+
+    def summary(self):
+        return summary(self.records)
+
+
+PROFILER = Profiler(REPORT)
+
+
+def set_report(path):
+    """Append this process's records to path from now on (None to stop)."""
+    PROFILER.path = path
+    PROFILER.file = None
+
+
+def stage(name, **tags):
+    """Time a stage on the process-wide profiler."""
+    return PROFILER.stage(name, **tags)
+
+
+def summary(records=None):
+    """Table of count, total/mean/max seconds, MB read and peak RSS for each stage."""
+    if records is None:
+        records = PROFILER.records
+    stages = {}
+    for record in records:
+        stats = stages.setdefault(record["stage"], {"count": 0, "seconds": 0., "max": 0.,
+                                                    "bytes": 0, "rss": 0.})
+        stats["count"] += 1
+        stats["seconds"] += record["seconds"]
+        stats["max"] = max(stats["max"], record["seconds"])
+        stats["bytes"] += record["bytes_read"] or 0
+        stats["rss"] = max(stats["rss"], record["peak_rss_mb"])
+    # Share of the time spent in top-level stages
+    total = sum(stats["seconds"] for name, stats in stages.items() if "/" not in name) or 1.
+
+    lines = ["%-28s %6s %10s %9s %9s %6s %10s %9s" % (
+        "stage", "count", "total s", "mean s", "max s", "%", "MB read", "peak MB")]
+    for name in sorted(stages):
+        stats = stages[name]
+        lines.append("%-28s %6d %10.3f %9.4f %9.4f %6.1f %10.1f %9.1f" % (
+            name, stats["count"], stats["seconds"], stats["seconds"] / stats["count"],
+            stats["max"], 100. * stats["seconds"] / total, stats["bytes"] / 1024.**2, stats["rss"]))
+    return "\n".join(lines)
+
+
+def load(path):
+    """Read the records of a JSON lines report."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print(path)
+        print(summary(load(path)))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Reusable map figures for the WRF plotting scripts.
+#
+# Building a cartopy figure (projection axes, coastlines, the 50m states, the
+# gridliner with its locators and formatters) costs far more than drawing the
+# field itself, and the scripts used to do it from scratch for every panel
+# without ever closing the figure.  A MapTemplate builds all of that once per
+# domain/projection; each panel only swaps in a new contourf, colorbar and
+# title before saving, so memory stays flat however many frames are drawn.
+#
+# The lat/lon mesh of a domain is projected into the map projection once and
+# kept with the template, so fields are contoured in native projection
+# coordinates instead of cartopy reprojecting the whole mesh for every panel.
+# WRF grids are regular in their own projection, which also allows a raster
+# path (render(..., raster=True)): the first frame creates an image and later
+# frames only replace its data, for animations with many frames.  The domain
+# geometry itself (lat/lon, projection, limits) is kept per domain by
+# domain_geometry rather than recomputed for every timestep, and the coastlines
+# and states come ready clipped and projected from featurecache.
+#
+# matplotlib.pyplot and cartopy are imported when the first template is built,
+# so importing this module (e.g. for domain_geometry alone) stays cheap.
+#
+# Only the MAX_TEMPLATES most recently used templates are kept open, so a
+# long-lived process drawing many different regions (worker.py) doesn't keep
+# a figure alive for every region it has ever drawn.
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import featurecache
+from instrument import stage
+
+# Templates already built in this process, keyed by domain/projection, least
+# recently used first
+TEMPLATES = OrderedDict()
+MAX_TEMPLATES = int(os.environ.get("WRF_MAX_TEMPLATES", 8))
+
+# Domain geometry already worked out in this process, keyed by domain_key
+DOMAINS = {}
+
+# Global attributes that pin down a WRF domain and its map projection
+DOMAIN_ATTRS = ("MAP_PROJ", "CEN_LAT", "CEN_LON", "TRUELAT1", "TRUELAT2", "STAND_LON",
+                "POLE_LAT", "POLE_LON", "DX", "DY", "GRID_ID", "I_PARENT_START", "J_PARENT_START",
+                "WEST-EAST_GRID_DIMENSION", "SOUTH-NORTH_GRID_DIMENSION")
+
+
+class MapTemplate:
+    """A figure with the map background drawn once and a swappable field layer.
+
+    cart_proj, xlim and ylim come from wrf's get_cartopy/cartopy_xlim/
+    cartopy_ylim; extent is [lon0, lon1, lat0, lat1] and xticks/yticks are the
+    gridline longitudes/latitudes.
+    """
+
+    def __init__(self, cart_proj, xlim, ylim, extent, xticks, yticks,
+                 figsize=(12, 9), dpi=200.):
+        import matplotlib.pyplot as plt
+        import matplotlib.ticker as mticker
+        import cartopy.crs as crs
+        from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
+
+        self.fig = plt.figure(figsize=figsize, dpi=dpi)
+        self.ax = self.fig.add_subplot(1, 1, 1, projection=cart_proj)
+
+        # Set the map bounds
+        self.ax.set_xlim(xlim)
+        self.ax.set_ylim(ylim)
+        self.ax.set_extent(extent, crs=crs.PlateCarree())
+
+        #add coastlines and states, clipped and projected for this view once
+        #and then read from the local feature cache (featurecache.py)
+        featurecache.add_feature(self.ax, "coastline", "50m", linewidth=.8)
+        featurecache.add_feature(self.ax, "states", "50m", edgecolor='grey', linewidth=0.6)
+
+        gridlines = self.ax.gridlines(color="grey", linestyle="dotted", draw_labels=True)
+        gridlines.xlabels_top = False
+        gridlines.ylabels_right = False
+        gridlines.xlocator = mticker.FixedLocator(xticks)
+        gridlines.ylocator = mticker.FixedLocator(yticks)
+        gridlines.xlabel_style = {'size': 8, 'color': 'black'}
+        gridlines.ylabel_style = {'size': 12, 'color': 'black'}
+        gridlines.xformatter = LONGITUDE_FORMATTER
+        gridlines.yformatter = LATITUDE_FORMATTER
+
+        # The colorbar axes is created by the first panel and reused afterwards
+        self.cax = None
+        self.cb = None
+        # Projected meshes of the domains drawn on this map, and the raster layer
+        self.meshes = {}
+        self.image = None
+        self.image_key = None
+        self.colorbar_source = None
+        # imshow rescales the axes to the image, so keep the map view to restore
+        self.view = (self.ax.get_xlim(), self.ax.get_ylim())
+
+    def projected(self, lons, lats):
+        """(x, y) of the lon/lat mesh in the map projection, worked out once per mesh."""
+        lons = np.asarray(lons)
+        lats = np.asarray(lats)
+        key = (lons.shape, float(lons[0, 0]), float(lons[-1, -1]), float(lats[0, 0]), float(lats[-1, -1]))
+        mesh = self.meshes.get(key)
+        if mesh is None:
+            import cartopy.crs as crs
+            points = self.ax.projection.transform_points(crs.PlateCarree(), lons, lats)
+            mesh = self.meshes[key] = (points[..., 0], points[..., 1])
+        return mesh
+
+    def raster_extent(self, x, y):
+        """imshow extent of a mesh that is regular in the map projection, else None.
+
+        Regular means within 1% of a grid length, which leaves room for the
+        single precision of the lat/lon in wrfout files.
+        """
+        if x.shape[1] < 2 or x.shape[0] < 2:
+            return None
+        dx = np.diff(x, axis=1)
+        dy = np.diff(y, axis=0)
+        tol_x, tol_y = 1e-2 * abs(dx.mean()), 1e-2 * abs(dy.mean())
+        if (np.ptp(dx) > tol_x or np.ptp(x[:, 0]) > tol_x
+                or np.ptp(dy) > tol_y or np.ptp(y[0, :]) > tol_y):
+            return None
+        hx, hy = dx.mean() / 2., dy.mean() / 2.
+        return (x[0, 0] - hx, x[0, -1] + hx, y[0, 0] - hy, y[-1, 0] + hy)
+
+    def draw_raster(self, x, y, data, levels, cmap, extend):
+        """Show data as an image on the projected grid, reusing the image of the last frame."""
+        import matplotlib.pyplot as plt
+        from matplotlib.colors import BoundaryNorm
+
+        cmap = plt.get_cmap(cmap)
+        norm = BoundaryNorm(levels, ncolors=cmap.N, extend=extend)
+        extent = self.raster_extent(x, y)
+        if extent is None:
+            # not a regular grid in this projection: a mesh of quadrilaterals instead
+            return self.ax.pcolormesh(x, y, data, cmap=cmap, norm=norm, shading="nearest")
+        # Same grid and colours as the last frame: only the pixels change, and
+        # the colorbar drawn for the image stays valid
+        key = (tuple(extent), data.shape, cmap.name, tuple(levels), extend)
+        if self.image is not None and self.image_key == key:
+            self.image.set_data(data)
+            return self.image
+        self.remove_image()
+        self.image = self.ax.imshow(data, origin="lower", extent=extent, cmap=cmap, norm=norm,
+                                    interpolation="nearest")
+        self.image_key = key
+        self.ax.set_xlim(self.view[0])
+        self.ax.set_ylim(self.view[1])
+        return self.image
+
+    def remove_image(self):
+        if self.image is not None:
+            self.image.remove()
+            self.image = None
+
+    def render(self, lons, lats, data, levels, title, filename, cmap=None,
+               cbar_label=None, extend='both', cbar_kwargs=None, raster=False):
+        """Draw one field on the map, save it to filename and clear it again.
+
+        With raster=True the field is drawn as an image of grid cells instead
+        of filled contours.
+        """
+        x, y = self.projected(lons, lats)
+        data = np.asarray(data)
+        if raster:
+            with stage("raster"):
+                contours = self.draw_raster(x, y, data, levels, cmap, extend)
+        else:
+            self.remove_image()
+            with stage("contourf"):
+                contours = self.ax.contourf(x, y, data, levels, cmap=cmap, extend=extend)
+        try:
+            if self.cax is None:
+                cb = self.cb = self.fig.colorbar(contours, ax=self.ax, **(cbar_kwargs or {}))
+                self.cax = cb.ax
+            elif contours is self.colorbar_source:
+                cb = self.cb  # the raster image of the last frame, colorbar unchanged
+            else:
+                self.cax.clear()
+                cb = self.cb = self.fig.colorbar(contours, cax=self.cax)
+            self.colorbar_source = contours
+            if cbar_label is not None:
+                cb.set_label(cbar_label)
+            self.ax.set_title(title, loc="left")
+            with stage("savefig"):
+                self.fig.savefig(filename)
+        finally:
+            if contours is not self.image:
+                remove_contours(contours)
+
+    def close(self):
+        import matplotlib.pyplot as plt
+        plt.close(self.fig)
+
+
+def remove_contours(contours):
+    """Remove a contour set from its axes (ContourSet.remove needs matplotlib 3.8)."""
+    if hasattr(contours, "collections") and not hasattr(contours, "get_paths"):
+        for collection in contours.collections:
+            collection.remove()
+    else:
+        contours.remove()
+
+
+def map_template(cart_proj, xlim, ylim, extent, xticks, yticks, **kwargs):
+    """Return the MapTemplate for this domain/projection, building it on first use."""
+    key = (cart_proj.proj4_init, tuple(np.asarray(xlim).tolist()), tuple(np.asarray(ylim).tolist()),
+           tuple(extent), tuple(np.asarray(xticks).tolist()), tuple(np.asarray(yticks).tolist()),
+           tuple(sorted(kwargs.items())))
+    template = TEMPLATES.get(key)
+    if template is not None:
+        TEMPLATES.move_to_end(key)
+        return template
+    template = TEMPLATES[key] = MapTemplate(cart_proj, xlim, ylim, extent, xticks, yticks, **kwargs)
+    while len(TEMPLATES) > max(MAX_TEMPLATES, 1):
+        TEMPLATES.popitem(last=False)[1].close()
+    return template
+
+
+def domain_key(ncfile):
+    """Identify the domain of an open wrfout file from its global attributes."""
+    return tuple(np.asarray(getattr(ncfile, name, np.nan)).item() for name in DOMAIN_ATTRS)
+
+
+def domain_geometry(ncfile):
+    """lats, lons, cart_proj, xlim and ylim of the domain of an open wrfout file.
+
+    Worked out from the terrain height the first time a domain is seen and
+    reused for every later file of the same domain.
+    """
+    key = domain_key(ncfile)
+    geometry = DOMAINS.get(key)
+    if geometry is None:
+        from wrf import getvar, to_np, latlon_coords, get_cartopy, cartopy_xlim, cartopy_ylim
+        ter = getvar(ncfile, "ter")
+        lats, lons = latlon_coords(ter)
+        geometry = DOMAINS[key] = {"lats": to_np(lats), "lons": to_np(lons),
+                                   "cart_proj": get_cartopy(ter),
+                                   "xlim": cartopy_xlim(ter), "ylim": cartopy_ylim(ter)}
+    return geometry
+
+
+def close_templates():
+    """Close every template figure built in this process."""
+    for template in TEMPLATES.values():
+        template.close()
+    TEMPLATES.clear()
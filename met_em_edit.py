@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Bulk land-use / green fraction perturbations of met_em files.
+#
+# A rule set (constant fills, category remaps such as 14 -> 16, optionally
+# limited to a lat/lon box) is applied to every met_em file, with the files
+# spread over worker processes.  Rules whose new value does not depend on the
+# old one are written straight to the variable without reading it first; rules
+# that do (remaps), or that are limited to a region, only read the smallest
+# hyperslab that covers the region.  Each file is timed and, unless turned off,
+# read back and checked after it has been written.
+#
+# Example, the perturbation greenfrac.py applies:
+#
+#   python met_em_edit.py --fill LU_INDEX=14 --fill GREENFRAC=100 -j 8 met_em.d01.*.nc
+
+import argparse
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from netCDF4 import Dataset
+
+
+class Fill:
+    """Set var to a constant, everywhere or inside a (lat1, lon1, lat2, lon2) box."""
+
+    def __init__(self, var, value, box=None):
+        self.var = var
+        self.value = value
+        self.box = box
+
+    def new_values(self, old):
+        return np.full(old.shape, self.value, dtype=old.dtype)
+
+    def check(self, expected, written):
+        return np.all(written == self.value)
+
+    def __repr__(self):
+        return "Fill(%s=%s%s)" % (self.var, self.value, box_label(self.box))
+
+
+class Remap:
+    """Replace categories of var, e.g. Remap("LU_INDEX", {14: 16}), optionally in a box."""
+
+    def __init__(self, var, mapping, box=None):
+        self.var = var
+        self.mapping = dict(mapping)
+        self.box = box
+
+    def new_values(self, old):
+        new = np.array(old, copy=True)
+        for before, after in self.mapping.items():
+            new[old == before] = after
+        return new
+
+    def check(self, expected, written):
+        return np.array_equal(expected, written)
+
+    def __repr__(self):
+        pairs = ",".join("%s->%s" % item for item in self.mapping.items())
+        return "Remap(%s:%s%s)" % (self.var, pairs, box_label(self.box))
+
+
+def box_label(box):
+    return "" if box is None else " in %s" % (tuple(box),)
+
+
+def region_mask(met_file, box):
+    """Boolean (south_north, west_east) mask of the box, from XLAT_M/XLONG_M."""
+    lat1, lon1, lat2, lon2 = box
+    lats = np.asarray(met_file.variables["XLAT_M"][0])
+    lons = np.asarray(met_file.variables["XLONG_M"][0])
+    return ((lats >= min(lat1, lat2)) & (lats <= max(lat1, lat2))
+            & (lons >= min(lon1, lon2)) & (lons <= max(lon1, lon2)))
+
+
+def apply_rule(met_file, rule, verify=True):
+    """Apply one rule to an open met_em file; returns True/False/None (not verified)."""
+    var = met_file.variables[rule.var]
+    lead = (slice(None),) * (var.ndim - 2)
+
+    if rule.box is None and isinstance(rule, Fill):
+        # The new value doesn't depend on the old one: write without reading
+        var[...] = rule.value
+        if not verify:
+            return None
+        return bool(rule.check(None, np.asarray(var[...])))
+
+    if rule.box is None:
+        index = (Ellipsis,)
+        mask = None
+    else:
+        mask = region_mask(met_file, rule.box)
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if rows.size == 0:
+            return True  # box is outside the domain, nothing to do
+        ys = slice(rows[0], rows[-1] + 1)
+        xs = slice(cols[0], cols[-1] + 1)
+        index = lead + (ys, xs)
+        mask = mask[ys, xs]
+
+    old = np.asarray(var[index])
+    new = rule.new_values(old)
+    if mask is not None:
+        new = np.where(mask, new, old)
+    var[index] = new
+    if not verify:
+        return None
+    written = np.asarray(var[index])
+    if mask is not None:
+        return bool(rule.check(new[..., mask], written[..., mask]))
+    return bool(rule.check(new, written))
+
+
+def edit_file(path, rules, verify=True):
+    """Apply every rule to one met_em file and report timing and verification."""
+    start = time.perf_counter()
+    result = {"path": path, "verified": None, "error": None}
+    try:
+        # append mode would silently create a missing file
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        with Dataset(path, "a") as met_file:
+            checks = [apply_rule(met_file, rule, verify) for rule in rules]
+        if verify:
+            result["verified"] = all(checks)
+    except Exception:
+        result["error"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def edit_files(paths, rules, workers=1, verify=True):
+    """Apply the rules to every file, in parallel when workers > 1."""
+    if workers <= 1:
+        return [edit_file(path, rules, verify) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(edit_file, paths, [rules] * len(paths), [verify] * len(paths)))
+
+
+def report(results):
+    """Print a per-file timing/verification table; returns the number of failures."""
+    failures = 0
+    for result in results:
+        if result["error"] is not None:
+            status = "ERROR"
+        elif result["verified"] is None:
+            status = "written"
+        else:
+            status = "ok" if result["verified"] else "MISMATCH"
+        failures += status in ("ERROR", "MISMATCH")
+        print("%-60s %8.3f s  %s" % (result["path"], result["seconds"], status))
+        if result["error"] is not None:
+            print(result["error"])
+    total = sum(result["seconds"] for result in results)
+    print("%d files, %.3f s of file time, %d failed" % (len(results), total, failures))
+    return failures
+
+
+def parse_value(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def parse_rules(fills, remaps, box):
+    rules = []
+    for item in fills or []:
+        var, value = item.split("=")
+        rules.append(Fill(var, parse_value(value), box))
+    for item in remaps or []:
+        var, pairs = item.split(":")
+        mapping = {}
+        for pair in pairs.split(","):
+            before, after = pair.split("=")
+            mapping[parse_value(before)] = parse_value(after)
+        rules.append(Remap(var, mapping, box))
+    return rules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply land-use/green fraction perturbations to met_em files")
+    parser.add_argument("files", nargs="+", help="met_em files to edit in place")
+    parser.add_argument("--fill", action="append", metavar="VAR=VALUE",
+                        help="set VAR to a constant, e.g. GREENFRAC=100")
+    parser.add_argument("--remap", action="append", metavar="VAR:OLD=NEW[,OLD=NEW]",
+                        help="replace categories, e.g. LU_INDEX:14=16")
+    parser.add_argument("--box", type=float, nargs=4, metavar=("LAT1", "LON1", "LAT2", "LON2"),
+                        help="only edit points inside this lat/lon box")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--no-verify", action="store_true", help="skip reading the result back")
+    args = parser.parse_args()
+
+    rules = parse_rules(args.fill, args.remap, args.box)
+    if not rules:
+        parser.error("give at least one --fill or --remap")
+    print("rules: " + ", ".join(repr(rule) for rule in rules))
+    results = edit_files(args.files, rules, args.workers, not args.no_verify)
+    raise SystemExit(1 if report(results) else 0)
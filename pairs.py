@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Matching control/perturbed wrfout files and reading them ahead of the plots.
+#
+# The difference plots need one control and one perturbed file per valid time.
+# match_pairs lines the two runs up by the valid time in the file names, so no
+# file has to be opened to find its partner.  prefetch then walks the pairs in
+# time order and runs the load step (open both files once, diagnose, close)
+# for the next pair on a background thread while the caller is still drawing
+# the current one, so the netCDF reads overlap with matplotlib instead of
+# adding to it.  The load step must return plain arrays: only the background
+# thread touches the netCDF files.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def valid_time(path):
+    """Valid time of a wrfout file from its name, e.g. 2021-08-25_00:00:00."""
+    return os.path.basename(path).split("_", 2)[2]
+
+
+def match_pairs(control_paths, perturbed_paths):
+    """[(valid, control path, perturbed path), ...] for the times both runs have, in time order.
+
+    A run with several files for the same valid time keeps the last one listed.
+    """
+    control = {valid_time(path): path for path in control_paths}
+    perturbed = {valid_time(path): path for path in perturbed_paths}
+    return [(valid, control[valid], perturbed[valid]) for valid in sorted(control) if valid in perturbed]
+
+
+def prefetch(pairs, load, ahead=1):
+    """Yield (valid, load(control path, perturbed path, valid)) for every pair, in order.
+
+    While the caller works on one pair, the next `ahead` pairs are loaded on a
+    background thread.  An exception raised by load is raised again when its
+    pair is reached, after the pairs before it have been yielded.
+    """
+    pairs = list(pairs)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futures = []
+        try:
+            for i, (valid, control_path, perturbed_path) in enumerate(pairs):
+                # Keep up to `ahead` loads queued behind the one about to be used
+                while len(futures) <= min(i + ahead, len(pairs) - 1):
+                    queued = pairs[len(futures)]
+                    futures.append(pool.submit(load, queued[1], queued[2], queued[0]))
+                yield valid, futures[i].result()
+                futures[i] = None  # let the loaded arrays go once they are drawn
+        finally:
+            for future in futures:
+                if future is not None:
+                    future.cancel()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# NetCDF store for the diagnosed fields.
+#
+# The plotting scripts used to keep their results only as PNG pixels, so a new
+# colormap, or any analysis of the shear or the 700 hPa temperatures, meant
+# diagnosing them from the wrfout files all over again.  They now also write
+# what they compute to a product store: a directory with one NetCDF file per
+# product (shear.nc, tempdiff.nc, areaavg_<window>.nc, ensemble.nc), holding
+#
+#   * a CF time coordinate along an unlimited Time dimension, one entry per
+#     valid time, written again in place when a time is recomputed;
+#   * XLAT/XLONG and the global attributes that define the WRF domain and its
+#     map projection, so the fields can be drawn without the wrfout files;
+#   * the fields themselves, zlib compressed in (1, 128, 128) chunks so that
+#     reading one time or a sub-region only decompresses the chunks it touches.
+#
+# render_products.py draws the plots from the store alone, and other tools
+# (ncview, xarray, ...) can open the files directly.  Writers from several
+# processes (0-6kmshear.py -j N) take turns through a lock file per product,
+# and readers take it shared so they never see a half-written file.
+#
+# The store location is ./products unless set with the WRF_PRODUCTS
+# environment variable or set_store().
+
+import datetime
+import fcntl
+import os
+from contextlib import contextmanager
+
+import numpy as np
+from netCDF4 import Dataset, date2num, num2date
+
+from wrfwindow import read_raw
+
+STORE = os.environ.get("WRF_PRODUCTS", "products")
+TIME_UNITS = "hours since 1970-01-01 00:00:00"
+WRF_TIME = "%Y-%m-%d_%H:%M:%S"
+CHUNK = 128
+
+# Global attributes copied from the wrfout file: the domain and its projection
+DOMAIN_ATTRS = ("MAP_PROJ", "CEN_LAT", "CEN_LON", "MOAD_CEN_LAT", "TRUELAT1", "TRUELAT2", "STAND_LON",
+                "POLE_LAT", "POLE_LON", "DX", "DY", "GRID_ID", "SIMULATION_START_DATE")
+
+
+def set_store(directory):
+    """Change the product store directory for this process."""
+    global STORE
+    STORE = directory
+
+
+def product_path(product):
+    return os.path.join(STORE, product + ".nc")
+
+
+@contextmanager
+def open_product(product, mode="r"):
+    """Open a product file under its lock: shared for reading, exclusive for writing."""
+    path = product_path(product)
+    if mode == "r":
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        try:
+            lock = open(path + ".lock", "a")
+        except PermissionError:
+            lock = None  # a read-only store has no writers to wait for
+        try:
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_SH)
+            with Dataset(path) as ncfile:
+                yield ncfile
+        finally:
+            if lock is not None:
+                lock.close()
+        return
+    os.makedirs(STORE, exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with Dataset(path, "a" if os.path.exists(path) else "w") as ncfile:
+            yield ncfile
+
+
+def init_product(ncfile, source=None, attrs=None):
+    """Time coordinate, grid and domain attributes of a new product file."""
+    ncfile.createDimension("Time", None)
+    time = ncfile.createVariable("time", "f8", ("Time",))
+    time.units = TIME_UNITS
+    time.calendar = "standard"
+    time.standard_name = "time"
+    if source is not None:
+        lats = read_raw(source, "XLAT", None, 0)[0][0]
+        lons = read_raw(source, "XLONG", None, 0)[0][0]
+        ncfile.createDimension("south_north", lats.shape[0])
+        ncfile.createDimension("west_east", lats.shape[1])
+        for name, values, long_name in (("XLAT", lats, "latitude"), ("XLONG", lons, "longitude")):
+            var = ncfile.createVariable(name, "f4", ("south_north", "west_east"), zlib=True)
+            var[:] = values
+            var.units = "degrees_north" if name == "XLAT" else "degrees_east"
+            var.standard_name = long_name
+        ncfile.setncatts({name: source.getncattr(name) for name in DOMAIN_ATTRS if name in source.ncattrs()})
+    if attrs:
+        ncfile.setncatts(attrs)
+
+
+def time_index(ncfile, valid):
+    """Index of valid along Time, appending it if it is new."""
+    when = date2num(datetime.datetime.strptime(valid, WRF_TIME), TIME_UNITS)
+    time = ncfile.variables["time"]
+    existing = np.where(np.abs(time[:] - when) < 1e-3)[0] if len(time) else []
+    if len(existing):
+        return int(existing[0])
+    time[len(time)] = when
+    return len(time) - 1
+
+
+def field_dims(ncfile, shape):
+    """Dimensions of a field of this shape: (member,) then the grid or bottom_top."""
+    dims = ncfile.dimensions
+    if "south_north" in dims and tuple(shape[-2:]) == (len(dims["south_north"]), len(dims["west_east"])):
+        inner = ("south_north", "west_east")
+    else:
+        inner = ("bottom_top",)
+    lead = tuple(shape[:len(shape) - len(inner)])
+    names = ("member",)[:len(lead)]
+    for name, size in zip(names + inner, shape):
+        if name not in dims:
+            ncfile.createDimension(name, size)
+    return names + inner
+
+
+def field_variable(ncfile, name, shape, timed=True, units=None, long_name=None):
+    """The variable for a field, created (compressed and chunked) on first use."""
+    if name in ncfile.variables:
+        return ncfile.variables[name]
+    dims = field_dims(ncfile, shape)
+    sizes = [min(len(ncfile.dimensions[dim]), CHUNK) if dim in ("south_north", "west_east")
+             else len(ncfile.dimensions[dim]) for dim in dims]
+    if timed:
+        dims = ("Time",) + dims
+        sizes = [1] + sizes
+    var = ncfile.createVariable(name, "f4", dims, zlib=True, complevel=4, chunksizes=sizes,
+                                fill_value=np.float32(np.nan))
+    if "south_north" in dims and "XLAT" in ncfile.variables:
+        var.coordinates = "XLONG XLAT"
+    if units is not None:
+        var.units = units
+    if long_name is not None:
+        var.long_name = long_name
+    return var
+
+
+def write(product, valid, fields, source=None, units=None, long_names=None, attrs=None):
+    """Write {name: array} for one valid time (YYYY-MM-DD_HH:MM:SS) to a product.
+
+    Arrays are (south_north, west_east) fields or (bottom_top,) profiles,
+    optionally with a leading member dimension.  source is an open wrfout
+    file to take the grid and domain attributes from when the product is new.
+    units and long_names are {name: str}.
+    """
+    write_times(product, [valid], {name: np.asarray(values)[np.newaxis] for name, values in fields.items()},
+                source, units, long_names, attrs)
+
+
+def write_times(product, valids, fields, source=None, units=None, long_names=None, attrs=None):
+    """Write several valid times at once, the arrays with a leading time axis, as write."""
+    units = units or {}
+    long_names = long_names or {}
+    with open_product(product, "a") as ncfile:
+        if "time" not in ncfile.variables:
+            init_product(ncfile, source, attrs)
+        elif attrs:
+            ncfile.setncatts(attrs)
+        indices = [time_index(ncfile, valid) for valid in valids]
+        for name, values in fields.items():
+            values = np.asarray(values)
+            var = field_variable(ncfile, name, values.shape[1:], units=units.get(name),
+                                 long_name=long_names.get(name))
+            for index, value in zip(indices, values):
+                var[index] = value
+
+
+def write_static(product, fields, units=None):
+    """Write {name: array} fields that don't depend on time, e.g. a mean profile."""
+    units = units or {}
+    with open_product(product, "a") as ncfile:
+        if "time" not in ncfile.variables:
+            init_product(ncfile)
+        for name, values in fields.items():
+            values = np.asarray(values)
+            field_variable(ncfile, name, values.shape, timed=False, units=units.get(name))[:] = values
+
+
+def stored_products(prefix=""):
+    """Names of the products in the store starting with prefix, sorted."""
+    if not os.path.isdir(STORE):
+        return []
+    return sorted(name[:-3] for name in os.listdir(STORE) if name.startswith(prefix) and name.endswith(".nc"))
+
+
+def stored_times(ncfile):
+    return [t.strftime(WRF_TIME) for t in num2date(ncfile.variables["time"][:], TIME_UNITS)]
+
+
+def valid_times(product):
+    """Valid times (YYYY-MM-DD_HH:MM:SS) in a product, in time order.
+
+    Times are appended to the file as they are written, so a time computed
+    late (e.g. retried after a failure) sits after later ones on disk.
+    """
+    if not os.path.exists(product_path(product)):
+        return []
+    with open_product(product) as ncfile:
+        return sorted(stored_times(ncfile))
+
+
+def read(product, names=None, valid=None, window=None):
+    """Read fields back from a product.
+
+    valid picks one valid time (default: all times in time order, as
+    valid_times, along a leading axis) and window = (x1, x2, y1, y2),
+    inclusive as in wrfwindow, a sub-region.  Only the chunks covering the
+    selection are read.  Returns {name: array} with
+    XLAT/XLONG (over the window) when the product has a grid.
+    """
+    with open_product(product) as ncfile:
+        timeidx = slice(None)
+        order = None
+        if valid is not None:
+            timeidx = stored_times(ncfile).index(valid)
+        elif len(ncfile.variables["time"]):
+            order = np.argsort(ncfile.variables["time"][:], kind="stable")
+        if names is None:
+            names = [name for name, var in ncfile.variables.items()
+                     if name not in ("time", "XLAT", "XLONG")]
+        names = list(names) + [name for name in ("XLAT", "XLONG") if name in ncfile.variables]
+        result = {}
+        for name in names:
+            var = ncfile.variables[name]
+            index = []
+            for dim in var.dimensions:
+                if dim == "Time":
+                    index.append(timeidx)
+                elif dim == "west_east" and window is not None:
+                    index.append(slice(window[0], window[1] + 1))
+                elif dim == "south_north" and window is not None:
+                    index.append(slice(window[2], window[3] + 1))
+                else:
+                    index.append(slice(None))
+            values = np.ma.filled(var[tuple(index)], np.nan)
+            if order is not None and "Time" in var.dimensions:
+                values = np.take(values, order, axis=var.dimensions.index("Time"))
+            result[name] = values
+        return result
+
+
+def attributes(product):
+    """Global attributes of a product."""
+    with open_product(product) as ncfile:
+        return {name: ncfile.getncattr(name) for name in ncfile.ncattrs()}
+
+
+def projection(attrs):
+    """cartopy projection of a WRF domain from its global attributes, like wrf's get_cartopy."""
+    import cartopy.crs as crs
+
+    globe = crs.Globe(ellipse=None, semimajor_axis=6370000, semiminor_axis=6370000)
+    map_proj = int(attrs["MAP_PROJ"])
+    if map_proj == 1:
+        return crs.LambertConformal(central_longitude=float(attrs["STAND_LON"]),
+                                    central_latitude=float(attrs.get("MOAD_CEN_LAT", attrs["CEN_LAT"])),
+                                    standard_parallels=(float(attrs["TRUELAT1"]), float(attrs["TRUELAT2"])),
+                                    globe=globe)
+    if map_proj == 2:
+        hemisphere = 90. if float(attrs["TRUELAT1"]) > 0 else -90.
+        return crs.Stereographic(central_latitude=hemisphere, central_longitude=float(attrs["STAND_LON"]),
+                                 true_scale_latitude=float(attrs["TRUELAT1"]), globe=globe)
+    if map_proj == 3:
+        return crs.Mercator(central_longitude=float(attrs["STAND_LON"]),
+                            latitude_true_scale=float(attrs["TRUELAT1"]), globe=globe)
+    raise ValueError("unsupported MAP_PROJ %d" % map_proj)
+
+
+def geometry(product):
+    """lats, lons, cart_proj, xlim and ylim of a product's domain, as maptemplate.domain_geometry."""
+    with open_product(product) as ncfile:
+        lats = ncfile.variables["XLAT"][:].astype(np.float64)
+        lons = ncfile.variables["XLONG"][:].astype(np.float64)
+        attrs = {name: ncfile.getncattr(name) for name in ncfile.ncattrs()}
+    return attrs_geometry(attrs, lats, lons)
+
+
+def attrs_geometry(attrs, lats, lons):
+    """Geometry dict of a domain from its WRF global attributes and lat/lon mesh."""
+    import cartopy.crs as crs
+
+    cart_proj = projection(attrs)
+    # Map limits from the corner mass points, as wrf's cartopy_xlim/ylim
+    corners = cart_proj.transform_points(crs.PlateCarree(), np.array([lons[0, 0], lons[-1, -1]]),
+                                         np.array([lats[0, 0], lats[-1, -1]]))
+    return {"lats": lats, "lons": lons, "cart_proj": cart_proj,
+            "xlim": (corners[0, 0], corners[1, 0]), "ylim": (corners[0, 1], corners[1, 1])}
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Vectorized solar geometry and radiation.
+#
+# The radiation notebooks work out the Sun-Earth distance ratio, declination,
+# hour angle, cos(Z), day length and Kex for one site at a time, clipping the
+# night-time cos(Z) with a Python loop.  Everything here is written with numpy
+# broadcasting instead, so the same functions take a single site, a long
+# observation table (numpy arrays or pandas columns), or every point of a WRF
+# domain for every hour of a year.  For the full-domain case the work is split
+# into chunks of days so memory stays bounded; see iter_extraterrestrial.
+#
+# Angles are in degrees at the interface (latitude, longitude) and radians
+# internally; hours are UTC unless lon is left at 0, in which case they are
+# local solar time.
+
+import numpy as np
+
+SOLAR_CONSTANT = 1367.      # W/m^2
+SIGMA = 5.67e-8             # Stefan-Boltzmann constant (W/m^2/K^4)
+
+# Largest number of output values computed at once by iter_extraterrestrial
+MAX_ELEMENTS = 2**24
+
+
+def day_angle(doy):
+    """Day angle theta = 2 pi n / 365 (radians)."""
+    return 2 * np.pi * np.asarray(doy, dtype=np.float64) / 365.
+
+
+def distance_ratio(doy):
+    """Sun-Earth distance correction (r0/r)**2 from Spencer's series."""
+    theta = day_angle(doy)
+    return (1.00011 + .034221 * np.cos(theta) + .001280 * np.sin(theta)
+            + .000719 * np.cos(2 * theta) + .000077 * np.sin(2 * theta))
+
+
+def declination(doy, tilt=23.5, solstice=172., year=365.):
+    """Solar declination (radians), tilt * cos(2 pi (n - solstice) / year)."""
+    return np.deg2rad(tilt) * np.cos(2 * np.pi * (np.asarray(doy, dtype=np.float64) - solstice) / year)
+
+
+def hour_angle(hour, lon=0.):
+    """Hour angle (radians), zero at solar noon, 15 degrees per hour.
+
+    lon is degrees east, so with hour in UTC the hour angle is for local solar
+    time at that longitude.
+    """
+    return np.deg2rad(15. * (np.asarray(hour, dtype=np.float64) - 12.) + np.asarray(lon, dtype=np.float64))
+
+
+def cos_zenith(lat, decl, h, clip=True):
+    """cos(Z) from latitude (degrees), declination and hour angle (radians).
+
+    With clip=True night-time values are set to 0.
+    """
+    lat = np.deg2rad(lat)
+    cosz = np.sin(lat) * np.sin(decl) + np.cos(lat) * np.cos(decl) * np.cos(h)
+    return np.maximum(cosz, 0.) if clip else cosz
+
+
+def day_length(lat, decl):
+    """Hours between sunrise and sunset; 0 for polar night and 24 for polar day."""
+    x = -np.tan(np.deg2rad(lat)) * np.tan(decl)
+    hsrss = np.arccos(np.clip(x, -1., 1.))
+    return 2 * np.rad2deg(hsrss) / 15.
+
+
+def extraterrestrial(doy, hour, lat, lon=0., solar_constant=SOLAR_CONSTANT, **decl_kwargs):
+    """Kex (W/m^2) on a horizontal surface at the top of the atmosphere.
+
+    All arguments broadcast against each other, e.g. doy[:, None, None, None],
+    hour[None, :, None, None] and 2-D lat/lon grids.
+    """
+    decl = declination(doy, **decl_kwargs)
+    cosz = cos_zenith(lat, decl, hour_angle(hour, lon))
+    return solar_constant * distance_ratio(doy) * cosz
+
+
+def air_mass(cosz, elevation=0.):
+    """Relative optical air mass 1/cos(Z), corrected for station elevation (m).
+
+    nan when the sun is below the horizon.
+    """
+    cosz = np.asarray(cosz, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        m = np.where(cosz > 0, 1. / cosz, np.nan)
+    return m * (1 - .0285 * (np.asarray(elevation, dtype=np.float64) / 304.8))
+
+
+def transmissivity(k_down, kex, m):
+    """Bulk atmospheric transmissivity (K_down / Kex)**(1/m)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (np.asarray(k_down, dtype=np.float64) / kex)**(1. / m)
+
+
+def ldown_swinbank(tair):
+    """Clear-sky longwave down (W/m^2) from air temperature alone (K)."""
+    return 5.31e-13 * np.asarray(tair, dtype=np.float64)**6
+
+
+def ldown_satterlund(tair, e_air):
+    """Clear-sky longwave down (W/m^2) from air temperature (K) and vapor pressure (hPa)."""
+    tair = np.asarray(tair, dtype=np.float64)
+    emissivity = 1.08 * (1 - np.exp(-np.asarray(e_air, dtype=np.float64)**(tair / 2016.)))
+    return emissivity * SIGMA * tair**4
+
+
+def iter_extraterrestrial(doy, hours, lat, lon, dtype=np.float32, max_elements=MAX_ELEMENTS,
+                          solar_constant=SOLAR_CONSTANT, **decl_kwargs):
+    """Yield (day slice, Kex) chunks over every day, hour and grid point.
+
+    doy and hours are 1-D; lat and lon are grids of the same shape (e.g.
+    XLAT/XLONG).  Each chunk is (ndays, nhours, *grid) with as many days as fit
+    in max_elements, so a year of hourly Kex over a full WRF domain can be
+    reduced or written out without ever being held in memory at once.
+    """
+    doy = np.atleast_1d(np.asarray(doy, dtype=np.float64))
+    hours = np.atleast_1d(np.asarray(hours, dtype=np.float64))
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    grid = np.broadcast_shapes(lat.shape, lon.shape)
+    per_day = hours.size * int(np.prod(grid))
+    step = max(1, max_elements // max(per_day, 1))
+
+    # Latitude and longitude terms are reused for every chunk
+    sinlat = np.sin(np.deg2rad(lat))
+    coslat = np.cos(np.deg2rad(lat))
+    h = hour_angle(hours.reshape((-1,) + (1,) * len(grid)), lon)
+
+    for start in range(0, doy.size, step):
+        days = slice(start, min(start + step, doy.size))
+        d = doy[days].reshape((-1, 1) + (1,) * len(grid))
+        decl = declination(d, **decl_kwargs)
+        cosz = sinlat * np.sin(decl) + coslat * np.cos(decl) * np.cos(h)
+        kex = solar_constant * distance_ratio(d) * np.maximum(cosz, 0.)
+        yield days, kex.astype(dtype, copy=False)
+
+
+def extraterrestrial_grid(doy, hours, lat, lon, out=None, daily_mean=False, solar_constant=SOLAR_CONSTANT,
+                          **kwargs):
+    """Kex for every day, hour and grid point, filled chunk by chunk.
+
+    Returns (ndays, nhours, *grid), or (ndays, *grid) with daily_mean=True.
+    out may be any array-like that supports slice assignment (an np.memmap or a
+    netCDF variable) to keep the result out of memory altogether.
+    """
+    doy = np.atleast_1d(doy)
+    hours = np.atleast_1d(hours)
+    grid = np.broadcast_shapes(np.shape(lat), np.shape(lon))
+    if out is None:
+        shape = (doy.size,) + ((() if daily_mean else (hours.size,))) + grid
+        out = np.empty(shape, dtype=kwargs.get("dtype", np.float32))
+    for days, kex in iter_extraterrestrial(doy, hours, lat, lon, solar_constant=solar_constant, **kwargs):
+        out[days] = kex.mean(axis=1) if daily_mean else kex
+    return out
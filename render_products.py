@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Redraw the plots from the product store alone.
+#
+# 0-6kmshear.py, sim_diff_temps.py and sim_cross_section.py (and watch.py)
+# write the fields they diagnose to the product store (products.py) as well as
+# drawing them.  This script draws the same plots from the store without
+# opening a single wrfout file, so changing a colormap, the contour levels or a
+# title takes seconds instead of a rerun of the diagnostics:
+#
+#   shear     control, perturbed and difference bulk shear, for every layer
+#             stored ("shear" for 0-6 km, shear_<layer> for the others)
+#   tempdiff  700 hPa temperature difference
+#   cross     the area-averaged time-height cross-sections, for every
+#             averaging box stored (one areaavg_<window> product per box)
+#
+# Example, redrawing two times of the shear with the raster path:
+#
+#   python render_products.py --products shear --times 2021-07-14_01:00:00 2021-07-14_02:00:00 --raster
+
+import argparse
+import importlib
+import os
+
+import products
+from areaavg import AreaAverager
+from instrument import stage, summary
+from maptemplate import close_templates
+
+PRODUCTS = ("shear", "tempdiff", "cross")
+
+
+def render_shear(times=None, raster=False, region=None):
+    # the script name isn't a valid identifier, so import it by name
+    script = importlib.import_module("0-6kmshear")
+    for product in sources("shear"):
+        layer = script.product_layer(product)
+        geometry = products.geometry(product)
+        stored = products.valid_times(product)
+        for valid in [valid for valid in times if valid in stored] if times else stored:
+            with stage("read", date=valid):
+                fields = dict(geometry, **products.read(product, ["control_shear", "pert_shear"], valid))
+            script.render_shear(fields, valid, valid, raster, region, layer)
+
+
+def render_tempdiff(times=None, raster=False, region=None):
+    from sim_diff_temps import render_temp_diff
+    geometry = products.geometry("tempdiff")
+    for valid in times or products.valid_times("tempdiff"):
+        with stage("read", date=valid):
+            fields = dict(geometry, **products.read("tempdiff", ["temp_diff"], valid))
+        render_temp_diff(fields, valid, raster, region)
+
+
+def render_cross(times=None, raster=False, region=None):
+    from sim_cross_section import plot_cross_sections
+    stored = sources("cross")
+    for product in stored:
+        with stage("read"):
+            averager = AreaAverager.from_store(product)
+        # with several boxes stored, tell their plots apart by the window
+        plot_cross_sections(averager, suffix=product[len("areaavg"):] if len(stored) > 1 else "")
+
+
+RENDERERS = {"shear": render_shear, "tempdiff": render_tempdiff, "cross": render_cross}
+
+
+def sources(product):
+    """The stored products a plot is drawn from."""
+    if product == "cross":
+        return products.stored_products("areaavg")
+    if product == "shear":
+        return products.stored_products("shear")
+    return [product] if os.path.exists(products.product_path(product)) else []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw the plots from the product store")
+    parser.add_argument("--store", help="product store directory (default: WRF_PRODUCTS or ./products)")
+    parser.add_argument("--products", nargs="+", choices=PRODUCTS, default=list(PRODUCTS))
+    parser.add_argument("--times", nargs="+", help="valid times to draw as YYYY-MM-DD_HH:MM:SS (default: all)")
+    parser.add_argument("--extent", type=float, nargs=4, metavar=("LON0", "LON1", "LAT0", "LAT1"),
+                        help="map extent instead of the scripts' default")
+    parser.add_argument("--raster", action="store_true",
+                        help="draw grid cells instead of filled contours (faster, for animations)")
+    args = parser.parse_args()
+
+    if args.store is not None:
+        products.set_store(args.store)
+    for product in args.products:
+        if not sources(product):
+            print("nothing stored for " + product)
+            continue
+        with stage(product):
+            RENDERERS[product](args.times, args.raster, args.extent)
+    close_templates()
+
+    # Time spent in each stage (set WRF_PROFILE to also keep a JSON lines report)
+    print(summary())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Fused bulk wind shear diagnostic.
+#
+# Going through getvar/interplevel builds full metadata-bearing ua, va, z and
+# pressure arrays, interpolates u and v separately, and then makes more
+# full-size temporaries for the shear components.  bulk_shear reads the raw
+# U, V, PH, PHB, HGT, U10 and V10 once and works column by column:
+#
+#   * the bracketing model levels of every target height above ground are
+#     found once, by a vinterp.VerticalInterpolator on the geopotential height,
+#     and shared by u and v;
+#   * u and v are interpolated straight from the staggered arrays at those
+#     levels and averaged onto the mass points there, instead of destaggering
+#     the whole 3-D field first;
+#   * every layer asked for (0-1, 0-3, 0-6 km, ...) is computed from the same
+#     reads, with a bottom of 0 meaning the 10 m wind.
+
+import numpy as np
+
+from wrfwindow import read_raw, G
+from vinterp import VerticalInterpolator
+
+# Layers as (bottom, top) heights above ground level in metres
+LAYERS = ((0., 6000.),)
+
+
+def shear_from_arrays(u, v, ph, phb, hgt, u10, v10, layers=LAYERS):
+    """Bulk shear magnitude for each layer from raw single-time WRF arrays.
+
+    u is (bottom_top, south_north, west_east_stag), v is (bottom_top,
+    south_north_stag, west_east), ph/phb are (bottom_top_stag, south_north,
+    west_east) and hgt/u10/v10 are (south_north, west_east).  ph is used as
+    scratch space for the geopotential height.  Returns a dict mapping each
+    (bottom, top) layer to a 2-D shear magnitude (m/s).
+    """
+    zstag = ph
+    zstag += phb
+    zstag /= G
+    z = 0.5 * (zstag[:-1] + zstag[1:])
+
+    winds = {0.: (u10, v10)}
+    heights = sorted(set(h for layer in layers for h in layer if h != 0))
+    if heights:
+        interpolator = VerticalInterpolator(z, heights, offset=hgt)
+        uz, vz = interpolator(u), interpolator(v)
+        for i, height in enumerate(heights):
+            winds[height] = (uz[i], vz[i])
+
+    shear = {}
+    for bottom, top in layers:
+        ubot, vbot = winds[bottom]
+        utop, vtop = winds[top]
+        shear[(bottom, top)] = np.hypot(utop - ubot, vtop - vbot)
+    return shear
+
+
+def bulk_shear(ncfile, layers=LAYERS, timeidx=0, window=None):
+    """Bulk shear magnitude for each (bottom, top) AGL layer in one wrfout time.
+
+    Reads every raw variable once, optionally only over a grid window
+    (x1, x2, y1, y2) as used by wrfwindow.  Returns {(bottom, top): 2-D array}.
+    """
+    def read(varname):
+        return read_raw(ncfile, varname, window, timeidx)[0][0]
+
+    return shear_from_arrays(read("U"), read("V"), read("PH"), read("PHB"), read("HGT"),
+                             read("U10"), read("V10"), layers)
+
+
+def parse_layers(text):
+    """Parse "0-1,0-3,0-6" (km) into ((0., 1000.), (0., 3000.), (0., 6000.))."""
+    layers = []
+    for item in text.split(","):
+        bottom, top = item.split("-")
+        layers.append((float(bottom) * 1000., float(top) * 1000.))
+    return tuple(layers)
@@ -8,22 +8,20 @@
 # More information on how to use wrf-python is available at https://wrf-python.readthedocs.io/en/main/basic_usage.html.
 # 
 # 
-# We start by importing the needed modules. These are drawn from five packages - netCDF4, matplotlib, numpy, cartopy, and wrf (short for wrf-python).
+# We start by importing the needed modules. These are drawn from five packages - netCDF4, matplotlib, numpy, cartopy, and wrf (short for wrf-python). Only netCDF4 and numpy are imported up front: matplotlib and cartopy are loaded by maptemplate when the first map is drawn and wrf-python by domain_geometry, so a job that only handles one timestep (e.g. sent to worker.py) starts quickly.
 
 # In[5]:
 
 
+from contextlib import ExitStack
 from netCDF4 import Dataset
-import matplotlib.pyplot as plt
-from matplotlib.cm import get_cmap
-import matplotlib.ticker as mticker
 import numpy as np
-import cartopy.crs as crs
-import cartopy.feature as cfeature
-from cartopy.feature import NaturalEarthFeature
-from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
-from wrf import (to_np, getvar, smooth2d, get_cartopy, cartopy_xlim,
-                 cartopy_ylim, latlon_coords, ll_to_xy, ALL_TIMES, interplevel)
+from wrfcache import cached
+from maptemplate import map_template, close_templates, domain_geometry
+from instrument import stage, summary
+from pairs import match_pairs, prefetch
+from vinterp import level_stack
+import products
 
 
 # In[7]:
@@ -39,57 +37,79 @@ def addzero(value):
    else:
        return str(value)
    
-# Loop through the dates/simulations
-for date in dates:
-   for date2 in dates2:
-       # Open the datasets
-       ncfile1 = Dataset("/home/valang/Working/WRF_Assignment4/WRF/test/em_real/control/wrfout_d01_2021-08-"+ date + ":00:00")
-       ncfile2 = Dataset("/home/valang/Working/WRF_Assignment4/WRF/test/em_real/perturbed/wrfout_d01_2021-08-" + date2 + ":00:00")
-   
-   cont_temp = getvar(ncfile1, "tc") # Get temperature data from both cont and pert wrf file
-   pert_temp = getvar(ncfile2, "tc")
-   cont_pres = getvar(ncfile1, "pressure")  
-   pert_pres = getvar(ncfile2, "pressure")
-   cont_t = interplevel(cont_temp, cont_pres, 700)  #identify temperature at 700hPa level
-   pert_t = interplevel(pert_temp, pert_pres, 700)
-
-   lats, lons = latlon_coords(cont_pres)
-   cart_proj = get_cartopy(cont_pres)
-
-   # Create a figure instanc and set up map projection, boundaries etc.
-   fig = plt.figure(figsize=(12,9), dpi=200.)
-   ax = plt.axes(projection=cart_proj) 
-   #add coastlines to the plot (resolution, linewidth)
-   ax.coastlines('50m', linewidth = .8)
-        
-   #add the states
-   ax.add_feature(cfeature.STATES.with_scale('50m'),edgecolor = 'grey', linewidth = 0.6)
-      
-   # Set the map bounds
-   ax.set_xlim(cartopy_xlim(cont_t))
-   ax.set_ylim(cartopy_ylim(cont_t))
-
-   #Find difference in temperature between pert and cont simulation and plot contours every .25 degrees from -5 to 5C
-   temp_diff = pert_t - cont_t
-   plt.contourf(to_np(lons), to_np(lats), to_np(temp_diff), np.arange(-5.,5,0.25), extend = 'both',
-            transform=crs.PlateCarree(),cmap=get_cmap("PRGn"))
-
-   plt.colorbar(ax=ax, shrink=.98)
-
-   ax.set_extent([-90.,-60.,45.,15.],crs=crs.PlateCarree())
-
-   gridlines = ax.gridlines(color="grey", linestyle="dotted", draw_labels=True)
-   gridlines.xlabels_top = False
-   gridlines.ylabels_right = False
-   gridlines.xlocator = mticker.FixedLocator(np.arange(-90.,-60.,5.))
-   gridlines.ylocator = mticker.FixedLocator(np.arange(15.,45.,5.))
-   gridlines.xlabel_style = {'size':8, 'color':'black'}
-   gridlines.ylabel_style = {'size':12, 'color':'black'}
-   gridlines.xformatter = LONGITUDE_FORMATTER
-   gridlines.yformatter = LATITUDE_FORMATTER
-       
-   plt.title("Shaded: 2021-08-" + date +":00:00 UTC Pertubation minus Control Temperature Difference at 700hPa", loc="left")
-   plt.savefig('2021-08-' + date + ':00:00' + '.png')
-
-
-
+control_dir = "/home/valang/Working/WRF_Assignment4/WRF/test/em_real/control/"
+perturbed_dir = "/home/valang/Working/WRF_Assignment4/WRF/test/em_real/perturbed/"
+extent = [-90.,-60.,45.,15.] #map extent (lon0, lon1, lat0, lat1)
+
+# Diagnose the 700 hPa perturbed minus control temperature difference for one
+# pair of open wrfout files.  Only plain arrays (and the projection) are
+# returned, so the result can be drawn without touching the files again
+def diagnose_temp_diff(ncfile1, ncfile2, valid):
+   #identify temperature at 700hPa level in both runs; the model levels
+   #bracketing 700hPa are searched once per file and reused for the temperature
+   with stage("diagnose", date=valid):
+      temp = cached([ncfile1, ncfile2], "tc_levels",
+                    lambda: level_stack([ncfile1, ncfile2], ["tc"], [700.])["tc"], levels=[700.])
+
+   #Find difference in temperature between pert and cont simulation
+   temp_diff = temp[1, 0] - temp[0, 0]
+   # Keep both runs' 700hPa temperature and the difference in the product
+   # store, so they can be redrawn (render_products.py) without the wrfout files
+   with stage("store", date=valid):
+      products.write("tempdiff", valid, {"control_t700": temp[0, 0], "pert_t700": temp[1, 0],
+                                         "temp_diff": temp_diff},
+                     source=ncfile1, units=dict.fromkeys(("control_t700", "pert_t700", "temp_diff"), "degC"),
+                     long_names={"control_t700": "control 700 hPa temperature",
+                                 "pert_t700": "perturbed 700 hPa temperature",
+                                 "temp_diff": "perturbed minus control 700 hPa temperature"})
+   # lat/lons, projection and map limits are worked out once per domain
+   fields = dict(domain_geometry(ncfile1))
+   fields["temp_diff"] = temp_diff
+   return fields
+
+# Draw the temperature difference from diagnose_temp_diff; valid is the valid
+# time used in the title and file name.  raster=True draws grid cells instead
+# of filled contours, for animations, and region is a map extent (lon0, lon1,
+# lat0, lat1) other than the default
+def render_temp_diff(fields, valid, raster=False, region=None):
+   # Map background (projection, boundaries, coastlines, states, gridlines) is
+   # built on the first date and reused for the rest
+   lon0, lon1, lat0, lat1 = region or extent
+   template = map_template(fields["cart_proj"], fields["xlim"], fields["ylim"],
+                           [lon0, lon1, lat0, lat1], np.arange(min(lon0, lon1), max(lon0, lon1), 5.),
+                           np.arange(min(lat0, lat1), max(lat0, lat1), 5.))
+
+   #plot contours every .25 degrees from -5 to 5C
+   with stage("render", date=valid):
+      template.render(fields["lons"], fields["lats"], fields["temp_diff"], np.arange(-5.,5,0.25),
+                      "Shaded: " + valid + " UTC Pertubation minus Control Temperature Difference at 700hPa",
+                      valid + '.png',
+                      cmap="PRGn", cbar_kwargs={'shrink': .98}, raster=raster)
+
+# Plot the temperature difference for one pair of open wrfout files
+def plot_temp_diff(ncfile1, ncfile2, valid):
+   render_temp_diff(diagnose_temp_diff(ncfile1, ncfile2, valid), valid)
+
+# Open one control/perturbed pair, diagnose it and close the files again;
+# run on the prefetch thread while the previous pair is being drawn
+def load_temp_diff(control_path, perturbed_path, valid):
+   with ExitStack() as files:
+      with stage("open", date=valid):
+         ncfile1 = files.enter_context(Dataset(control_path))
+         ncfile2 = files.enter_context(Dataset(perturbed_path))
+      return diagnose_temp_diff(ncfile1, ncfile2, valid)
+
+
+if __name__ == "__main__":
+   # Match the control and perturbed files by valid time, so each file is
+   # opened exactly once, and diagnose the next pair in the background while
+   # the current one is rendered
+   pairs = match_pairs([control_dir + "wrfout_d01_2021-08-" + date + ":00:00" for date in dates],
+                       [perturbed_dir + "wrfout_d01_2021-08-" + date2 + ":00:00" for date2 in dates2])
+   for valid, fields in prefetch(pairs, load_temp_diff):
+      render_temp_diff(fields, valid)
+
+   close_templates()
+
+   # Time spent in each stage (set WRF_PROFILE to also keep a JSON lines report)
+   print(summary())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Spectral diagnostics over a whole solution history.
+#
+# The notebooks' power/isolate/transform helpers take one row at a time.  The
+# versions here take the full (..., time, x) array from advection.advect and
+# do a single batched FFT along the spatial (last) axis, and isolate/transform
+# accept a list of wavenumbers at once.  From the time-wavenumber amplitudes we
+# get per-wavenumber amplification factors and damping rates without any
+# Python-level loops.
+
+import numpy as np
+
+
+def spectrum(h):
+    """Complex rfft of every row along the spatial (last) axis."""
+    return np.fft.rfft(np.asarray(h, dtype=np.float64), axis=-1)
+
+
+def power(h):
+    """Power spectrum |rfft|**2 of every row: (..., time, x) -> (..., time, k)."""
+    return np.abs(spectrum(h))**2
+
+
+def wavelengths(points, dx=1.):
+    """Wavelength of each rfft wavenumber in units of dx (inf for k=0).
+
+    Same as 1/freqs/dx in the notebooks with freqs = np.fft.rfftfreq(points, dx).
+    """
+    with np.errstate(divide="ignore"):
+        return 1. / np.fft.rfftfreq(points, dx) / dx
+
+
+def filter_wavenumbers(h, mask):
+    """Apply one or more boolean wavenumber masks and transform back.
+
+    mask is (nk,) or (nmask, nk); the result is (..., x) or (nmask, ..., x).
+    """
+    h = np.asarray(h, dtype=np.float64)
+    points = h.shape[-1]
+    fwd = spectrum(h)
+    mask = np.asarray(mask)
+    if mask.ndim == 1:
+        return np.fft.irfft(fwd * mask, n=points, axis=-1)
+    mask = mask.reshape((mask.shape[0],) + (1,) * (fwd.ndim - 1) + (mask.shape[-1],))
+    return np.fft.irfft(fwd[np.newaxis] * mask, n=points, axis=-1)
+
+
+def isolate(h, wn):
+    """Keep only wavenumber wn (or each of a list of wavenumbers)."""
+    k = np.arange(np.asarray(h).shape[-1] // 2 + 1)
+    wn = np.asarray(wn)
+    return filter_wavenumbers(h, k == wn[..., np.newaxis] if wn.ndim else k == wn)
+
+
+def transform(h, wn):
+    """Truncate to wavenumbers below wn (or below each of a list of wn)."""
+    k = np.arange(np.asarray(h).shape[-1] // 2 + 1)
+    wn = np.asarray(wn)
+    return filter_wavenumbers(h, k < wn[..., np.newaxis] if wn.ndim else k < wn)
+
+
+def amplitude(h):
+    """Spectral amplitude |rfft| of every row: (..., time, x) -> (..., time, k)."""
+    return np.abs(spectrum(h))
+
+
+def step_amplification(h):
+    """Amplitude ratio between consecutive saved times for every wavenumber.
+
+    Returns (..., time-1, k); nan where the earlier amplitude is zero.
+    """
+    amp = amplitude(h)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(amp[..., :-1, :] > 0, amp[..., 1:, :] / amp[..., :-1, :], np.nan)
+
+
+def log_amplitude_slope(h):
+    """Least-squares slope of log|rfft| against saved-time index, per wavenumber.
+
+    Fitting the whole history smooths over the leapfrog computational mode,
+    which makes single step ratios oscillate.  Returns (..., k).
+    """
+    amp = amplitude(h)
+    tiny = np.finfo(np.float64).tiny
+    logamp = np.log(np.maximum(amp, tiny))
+    n = amp.shape[-2]
+    t = np.arange(n) - (n - 1) / 2.
+    anomaly = logamp - logamp.mean(axis=-2, keepdims=True)
+    return np.einsum("t,...tk->...k", t, anomaly) / np.sum(t**2)
+
+
+def amplification_factor(h, save_every=1):
+    """Mean amplification factor per model step for every wavenumber (..., k).
+
+    |A| < 1 is damping, |A| > 1 growth.  save_every is the number of model
+    steps between saved times in h.
+    """
+    return np.exp(log_amplitude_slope(h) / save_every)
+
+
+def damping_rate(h, dt, save_every=1):
+    """E-folding damping rate (1/s) for every wavenumber (..., k); negative means growth."""
+    return -log_amplitude_slope(h) / (dt * save_every)
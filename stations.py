@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Model time series at observing stations.
+#
+# "Plot ASOS and AQS Locations.ipynb" only places the State Fair, AQS and
+# ASOS/AWOS sites on a map, one plt.scatter call per site.  The sites are now
+# kept in a catalog, stations.csv (id, network, site, name, lat, lon), and
+# this module pulls WRF time series at all of them for model-versus-observation
+# comparisons:
+#
+#   * the grid of a domain is projected into its map projection once and put
+#     in a KD-tree (scipy's cKDTree), so any number of stations find their
+#     nearest mass point in one vectorized query, with the distance to it;
+#   * for bilinear sampling the fractional grid indices come from the same
+#     projection (crosssection.py), giving the four surrounding points and
+#     weights of every station;
+#   * stations off the domain are dropped, and everything is kept per domain
+#     and reused for every file of the run;
+#   * each wrfout file is then read once per variable, over the grid window
+#     covering all the stations and for all of its times, and one gather
+#     gives every station's series.
+#
+# Example, the 2 m temperature and 10 m wind at the AQS and ASOS sites:
+#
+#   python stations.py control/wrfout_d01_* --vars T2 U10 V10 --network AQS ASOS --out series.csv
+
+import argparse
+import csv
+import os
+
+import numpy as np
+from netCDF4 import Dataset
+
+from crosssection import fractional_index, grid_geometry
+from instrument import stage, summary
+from maptemplate import domain_key
+from wrfwindow import extract_times, window_getvar
+
+STATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.csv")
+VARIABLES = ("T2", "Q2", "U10", "V10", "PSFC")
+
+# KD-trees of the domains seen in this process, keyed by maptemplate.domain_key
+TREES = {}
+# StationIndex built in this process, keyed by domain, stations and method
+INDICES = {}
+
+
+def load_stations(path=STATIONS, networks=None, sites=None):
+    """The station catalog as {column: array}, optionally only some networks or sites."""
+    with open(path, newline="") as f:
+        rows = [row for row in csv.DictReader(f)
+                if (not networks or row["network"] in networks) and (not sites or row["site"] in sites)]
+    columns = {name: np.array([row[name] for row in rows]) for name in ("id", "network", "site", "name")}
+    columns["lat"] = np.array([float(row["lat"]) for row in rows])
+    columns["lon"] = np.array([float(row["lon"]) for row in rows])
+    return columns
+
+
+def grid_tree(ncfile):
+    """cKDTree of the projected mass points of the domain, built once per domain."""
+    key = domain_key(ncfile)
+    tree = TREES.get(key)
+    if tree is None:
+        import cartopy.crs as crs
+        from scipy.spatial import cKDTree
+
+        geometry = grid_geometry(ncfile)
+        points = geometry["cart_proj"].transform_points(crs.PlateCarree(), geometry["lons"].astype(np.float64),
+                                                        geometry["lats"].astype(np.float64))
+        tree = TREES[key] = cKDTree(points[..., :2].reshape(-1, 2))
+    return tree
+
+
+class StationIndex:
+    """Grid points and weights of a set of stations on one WRF domain.
+
+    method is "nearest" (the nearest mass point, from the KD-tree) or
+    "bilinear" (the four surrounding mass points).  Stations off the domain
+    are left out; self.stations holds the catalog entries kept, in the order
+    of the extracted series.
+    """
+
+    def __init__(self, ncfile, stations, method="nearest"):
+        import cartopy.crs as crs
+
+        if method not in ("nearest", "bilinear"):
+            raise ValueError("method must be nearest or bilinear")
+        self.method = method
+        geometry = grid_geometry(ncfile)
+        ny, nx = geometry["shape"]
+
+        points = geometry["cart_proj"].transform_points(crs.PlateCarree(), stations["lon"], stations["lat"])
+        distance, nearest = grid_tree(ncfile).query(points[:, :2])
+        fx, fy = fractional_index(geometry, stations["lat"], stations["lon"])
+        inside = (fx >= -0.5) & (fx <= nx - 0.5) & (fy >= -0.5) & (fy <= ny - 0.5)
+        if not inside.any():
+            raise ValueError("no station is on the domain")
+        self.stations = {name: values[inside] for name, values in stations.items()}
+        # Distance from each station to its nearest mass point (km)
+        self.distance = distance[inside] / 1000.
+        self.nearest = np.unravel_index(nearest[inside], (ny, nx))
+
+        if method == "nearest":
+            j, i = self.nearest
+            corners = [(j, i)]
+            weights = np.ones((1, len(j)))
+        else:
+            fx = np.clip(fx[inside], 0, nx - 1)
+            fy = np.clip(fy[inside], 0, ny - 1)
+            i = np.minimum(np.floor(fx).astype(np.intp), nx - 2)
+            j = np.minimum(np.floor(fy).astype(np.intp), ny - 2)
+            wx = fx - i
+            wy = fy - j
+            corners = [(j, i), (j, i + 1), (j + 1, i), (j + 1, i + 1)]
+            weights = np.array([(1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx])
+
+        # Read only the window covering every station's grid points
+        rows = np.concatenate([j for j, i in corners])
+        cols = np.concatenate([i for j, i in corners])
+        self.window = (int(cols.min()), int(cols.max()), int(rows.min()), int(rows.max()))
+        x1, x2, y1, y2 = self.window
+        self.corners = [(j - y1, i - x1) for j, i in corners]
+        self.weights = weights
+
+    def gather(self, values):
+        """values (..., south_north, west_east) over the window at every station: (..., station)."""
+        values = np.asarray(values)
+        return sum(values[..., j, i] * weight for (j, i), weight in zip(self.corners, self.weights))
+
+    def read(self, ncfile, names=VARIABLES, timeidx=slice(None)):
+        """{name: (Time, ..., station)} for window_getvar fields of every time in ncfile."""
+        return {name: self.gather(window_getvar(ncfile, name, self.window, timeidx)) for name in names}
+
+
+def station_index(ncfile, stations, method="nearest"):
+    """StationIndex of stations on the domain of ncfile, built once per domain and method."""
+    key = (domain_key(ncfile), tuple(stations["id"]), method)
+    index = INDICES.get(key)
+    if index is None:
+        index = INDICES[key] = StationIndex(ncfile, stations, method)
+    return index
+
+
+def extract(paths, stations, names=VARIABLES, method="nearest"):
+    """Time series of names at the stations from every time of the wrfout files.
+
+    Returns (times, series, index): datetime64 times, {name: (time, ...,
+    station)} and the StationIndex of the first file's domain, whose
+    .stations are the stations along the last axis.
+    """
+    times = []
+    series = {name: [] for name in names}
+    index = None
+    for path in paths:
+        with Dataset(path) as ncfile:
+            file_index = station_index(ncfile, stations, method)
+            if index is None:
+                index = file_index
+            elif file_index is not index:
+                raise ValueError("%s is on a different domain from %s" % (path, paths[0]))
+            with stage("extract", file=os.path.basename(path)):
+                times.append(extract_times(ncfile))
+                for name, values in index.read(ncfile, names).items():
+                    series[name].append(values)
+    return (np.concatenate(times) if times else np.array([], dtype="datetime64[ns]"),
+            {name: np.concatenate(values) for name, values in series.items() if values}, index)
+
+
+def write_series(path, times, series, index):
+    """Write the series as CSV, one row per time and station, one column per variable.
+
+    Variables with levels (e.g. tc) get one column per model level, tc_0,
+    tc_1, ... from the bottom up.
+    """
+    columns = []
+    values = []
+    for name, data in series.items():
+        if data.ndim == 2:
+            columns.append(name)
+        else:
+            data = data.reshape(data.shape[0], -1, data.shape[-1])
+            columns.extend("%s_%d" % (name, k) for k in range(data.shape[1]))
+        values.append(data.reshape(data.shape[0], -1, data.shape[-1]))
+    values = np.concatenate(values, axis=1) if values else np.empty((len(times), 0, len(index.distance)))
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["time", "id", "network", "site", "distance_km"] + columns)
+        for t, time in enumerate(times):
+            valid = str(time)[:19]
+            for s, station in enumerate(index.stations["id"]):
+                writer.writerow([valid, station, index.stations["network"][s], index.stations["site"][s],
+                                 "%.2f" % index.distance[s]] + ["%.6g" % value for value in values[t, :, s]])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WRF time series at the stations of a catalog")
+    parser.add_argument("wrfout", nargs="+", help="wrfout files of one domain, in time order")
+    parser.add_argument("--stations", default=STATIONS, help="station catalog (default: stations.csv)")
+    parser.add_argument("--vars", nargs="+", default=list(VARIABLES),
+                        help="surface variables or window_getvar diagnostics (3-D ones get a column per level)")
+    parser.add_argument("--network", nargs="+", help="only these networks (fair, AQS, ASOS, AWOS)")
+    parser.add_argument("--site", nargs="+", help="only these sites (WI, NC, TX, ...)")
+    parser.add_argument("--method", choices=("nearest", "bilinear"), default="bilinear")
+    parser.add_argument("--out", default="station_series.csv", help="CSV file for the series")
+    args = parser.parse_args()
+
+    stations = load_stations(args.stations, args.network, args.site)
+    with stage("index"):
+        with Dataset(args.wrfout[0]) as ncfile:
+            index = station_index(ncfile, stations, args.method)
+    print("%d of %d stations on the domain" % (len(index.distance), len(stations["id"])))
+
+    times, series, index = extract(args.wrfout, stations, args.vars, args.method)
+    with stage("write"):
+        write_series(args.out, times, series, index)
+
+    # Time spent in each stage (set WRF_PROFILE to also keep a JSON lines report)
+    print(summary())
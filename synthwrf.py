@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Synthetic wrfout and met_em files for benchmarking and trying the scripts
+# on machines that don't have the real model output.
+#
+# The files follow the WRF schema closely enough for wrf-python and for the
+# modules in this directory: the usual dimensions (including the staggered
+# ones), the global projection attributes, Times/XTIME, XLAT/XLONG on all three
+# grids, and the fields the scripts read (U, V, W, PH, PHB, P, PB, T, QVAPOR,
+# RQVCUTEN, RTHCUTEN, U10, V10, T2, PSFC, HGT, LU_INDEX, GREENFRAC ...).  The
+# values are smooth, physically plausible profiles plus a little noise, not a
+# model solution.  Fields are written one level at a time, so domains of
+# 1000x1000 points and more can be generated without holding whole 3-D arrays.
+
+import argparse
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from netCDF4 import Dataset
+from pyproj import Proj
+
+G = 9.81
+WRF_TIME = "%Y-%m-%d_%H:%M:%S"
+
+
+class Domain:
+    """Lambert conformal grid description shared by every synthetic file."""
+
+    def __init__(self, nx=100, ny=100, nz=40, dx=12000., cen_lat=38., cen_lon=-92.,
+                 truelat1=30., truelat2=60., ztop=20000.):
+        self.nx, self.ny, self.nz = nx, ny, nz
+        self.dx = dx
+        self.cen_lat, self.cen_lon = cen_lat, cen_lon
+        self.truelat1, self.truelat2 = truelat1, truelat2
+        self.ztop = ztop
+        self.proj = Proj(proj="lcc", lat_1=truelat1, lat_2=truelat2, lat_0=cen_lat,
+                         lon_0=cen_lon, a=6370000, b=6370000)
+
+    def latlon(self, xstag=False, ystag=False):
+        """(lat, lon) of the mass grid, or of the u (xstag) or v (ystag) points."""
+        nx = self.nx + xstag
+        ny = self.ny + ystag
+        x = (np.arange(nx) - (nx - 1) / 2.) * self.dx
+        y = (np.arange(ny) - (ny - 1) / 2.) * self.dx
+        xx, yy = np.meshgrid(x, y)
+        lon, lat = self.proj(xx, yy, inverse=True)
+        return lat.astype(np.float32), lon.astype(np.float32)
+
+    def terrain(self):
+        """A smooth hill in the middle of the domain (m)."""
+        y, x = np.mgrid[0:self.ny, 0:self.nx]
+        r2 = ((x - self.nx / 2.) / (self.nx / 5.))**2 + ((y - self.ny / 2.) / (self.ny / 5.))**2
+        return (200. + 1500. * np.exp(-r2)).astype(np.float32)
+
+    def eta_stag(self):
+        """Full-level eta values, 1 at the surface to 0 at the model top."""
+        return (1 - np.linspace(0., 1., self.nz + 1)**1.4).astype(np.float32)
+
+    def attrs(self, start):
+        return {
+            "TITLE": " OUTPUT FROM WRF V4.3 MODEL (synthetic)",
+            "START_DATE": start, "SIMULATION_START_DATE": start,
+            "WEST-EAST_GRID_DIMENSION": self.nx + 1,
+            "SOUTH-NORTH_GRID_DIMENSION": self.ny + 1,
+            "BOTTOM-TOP_GRID_DIMENSION": self.nz + 1,
+            "DX": np.float32(self.dx), "DY": np.float32(self.dx),
+            "GRIDTYPE": "C", "DT": np.float32(60.),
+            "CEN_LAT": np.float32(self.cen_lat), "CEN_LON": np.float32(self.cen_lon),
+            "TRUELAT1": np.float32(self.truelat1), "TRUELAT2": np.float32(self.truelat2),
+            "MOAD_CEN_LAT": np.float32(self.cen_lat), "STAND_LON": np.float32(self.cen_lon),
+            "POLE_LAT": np.float32(90.), "POLE_LON": np.float32(0.),
+            "MAP_PROJ": np.int32(1), "MAP_PROJ_CHAR": "Lambert Conformal",
+            "GRID_ID": np.int32(1), "PARENT_ID": np.int32(0),
+            "I_PARENT_START": np.int32(1), "J_PARENT_START": np.int32(1),
+            "PARENT_GRID_RATIO": np.int32(1),
+        }
+
+
+def add_var(ncfile, name, dims, description, units, stagger="", dtype="f4"):
+    var = ncfile.createVariable(name, dtype, dims, zlib=False)
+    var.FieldType = np.int32(104)
+    var.MemoryOrder = {4: "XYZ", 3: "XY ", 2: "Z  ", 1: "0  "}[len(dims)]
+    var.description = description
+    var.units = units
+    var.stagger = stagger
+    if "west_east_stag" in dims:
+        var.coordinates = "XLONG_U XLAT_U XTIME"
+    elif "south_north_stag" in dims:
+        var.coordinates = "XLONG_V XLAT_V XTIME"
+    elif "west_east" in dims:
+        var.coordinates = "XLONG XLAT XTIME"
+    return var
+
+
+def add_times(ncfile, times, start):
+    ncfile.createDimension("DateStrLen", 19)
+    var = ncfile.createVariable("Times", "S1", ("Time", "DateStrLen"))
+    xtime = ncfile.createVariable("XTIME", "f4", ("Time",))
+    xtime.units = "minutes since " + start.strftime("%Y-%m-%d %H:%M:%S")
+    xtime.description = "minutes since " + start.strftime("%Y-%m-%d %H:%M:%S")
+    xtime.stagger = ""
+    for i, t in enumerate(times):
+        var[i] = np.array(list(t.strftime(WRF_TIME)), dtype="S1")
+        xtime[i] = (t - start).total_seconds() / 60.
+
+
+def write_wrfout(path, domain, times, start=None, seed=0, perturbation=0.):
+    """Write one wrfout file holding the given valid times (datetimes).
+
+    perturbation scales a smooth extra temperature/wind anomaly, so a
+    "perturbed" run differs from the control in a structured way.
+    """
+    start = start or times[0]
+    rng = np.random.default_rng(seed)
+    nx, ny, nz = domain.nx, domain.ny, domain.nz
+
+    with Dataset(path, "w", format="NETCDF4") as nc:
+        for name, size in (("Time", None), ("west_east", nx), ("south_north", ny),
+                           ("bottom_top", nz), ("bottom_top_stag", nz + 1),
+                           ("west_east_stag", nx + 1), ("south_north_stag", ny + 1),
+                           ("soil_layers_stag", 4)):
+            nc.createDimension(name, size)
+        nc.setncatts(domain.attrs(start.strftime(WRF_TIME)))
+        add_times(nc, times, start)
+
+        hgt = domain.terrain()
+        eta = domain.eta_stag()
+        eta_mass = 0.5 * (eta[:-1] + eta[1:])
+        y, x = np.mgrid[0:ny, 0:nx]
+        anomaly = perturbation * np.exp(-(((x - 0.6 * nx) / (0.1 * nx + 1))**2
+                                          + ((y - 0.4 * ny) / (0.1 * ny + 1))**2))
+
+        grids = {"": domain.latlon(), "_U": domain.latlon(xstag=True), "_V": domain.latlon(ystag=True)}
+        dims2 = {"": ("Time", "south_north", "west_east"),
+                 "_U": ("Time", "south_north", "west_east_stag"),
+                 "_V": ("Time", "south_north_stag", "west_east")}
+        for suffix, (lat, lon) in grids.items():
+            vlat = add_var(nc, "XLAT" + suffix, dims2[suffix], "LATITUDE, SOUTH IS NEGATIVE", "degree_north")
+            vlon = add_var(nc, "XLONG" + suffix, dims2[suffix], "LONGITUDE, WEST IS NEGATIVE", "degree_east")
+            for t in range(len(times)):
+                vlat[t] = lat
+                vlon[t] = lon
+
+        mass3 = ("Time", "bottom_top", "south_north", "west_east")
+        stagz3 = ("Time", "bottom_top_stag", "south_north", "west_east")
+        v = {
+            "U": add_var(nc, "U", ("Time", "bottom_top", "south_north", "west_east_stag"),
+                         "x-wind component", "m s-1", "X"),
+            "V": add_var(nc, "V", ("Time", "bottom_top", "south_north_stag", "west_east"),
+                         "y-wind component", "m s-1", "Y"),
+            "W": add_var(nc, "W", stagz3, "z-wind component", "m s-1", "Z"),
+            "PH": add_var(nc, "PH", stagz3, "perturbation geopotential", "m2 s-2", "Z"),
+            "PHB": add_var(nc, "PHB", stagz3, "base-state geopotential", "m2 s-2", "Z"),
+            "T": add_var(nc, "T", mass3, "perturbation potential temperature theta-t0", "K"),
+            "P": add_var(nc, "P", mass3, "perturbation pressure", "Pa"),
+            "PB": add_var(nc, "PB", mass3, "BASE STATE PRESSURE", "Pa"),
+            "QVAPOR": add_var(nc, "QVAPOR", mass3, "Water vapor mixing ratio", "kg kg-1"),
+            "RQVCUTEN": add_var(nc, "RQVCUTEN", mass3, "COUPLED Qv TENDENCY DUE TO CUMULUS SCHEME", "Pa kg kg-1 s-1"),
+            "RTHCUTEN": add_var(nc, "RTHCUTEN", mass3, "COUPLED THETA TENDENCY DUE TO CUMULUS SCHEME", "Pa K s-1"),
+        }
+        surface = {
+            "HGT": ("Terrain Height", "m"), "U10": ("U at 10 M", "m s-1"), "V10": ("V at 10 M", "m s-1"),
+            "T2": ("TEMP at 2 M", "K"), "Q2": ("QV at 2 M", "kg kg-1"), "PSFC": ("SFC PRESSURE", "Pa"),
+            "LU_INDEX": ("LAND USE CATEGORY", ""), "LANDMASK": ("LAND MASK (1 FOR LAND, 0 FOR WATER)", ""),
+            "VEGFRA": ("VEGETATION FRACTION", ""),
+        }
+        for name, (description, units) in surface.items():
+            v[name] = add_var(nc, name, dims2[""], description, units)
+        znu = add_var(nc, "ZNU", ("Time", "bottom_top"), "eta values on half (mass) levels", "")
+        znw = add_var(nc, "ZNW", ("Time", "bottom_top_stag"), "eta values on full (w) levels", "")
+        ptop = add_var(nc, "P_TOP", ("Time",), "PRESSURE TOP OF THE MODEL", "Pa")
+
+        # Heights of the full levels follow the terrain at the bottom and
+        # flatten out towards the model top
+        def zfull(k):
+            return hgt + (domain.ztop - hgt) * (1 - eta[k])
+
+        for t in range(len(times)):
+            phase = 2 * np.pi * t / 24.
+            znu[t] = eta_mass
+            znw[t] = eta
+            ptop[t] = 5000.
+            v["HGT"][t] = hgt
+            for k in range(nz + 1):
+                z = zfull(k)
+                v["PHB"][t, k] = z * G
+                v["PH"][t, k] = 5. * G * np.sin(phase + x / 7.) * (k > 0)
+                v["W"][t, k] = 0.05 * rng.standard_normal((ny, nx)) * (k > 0)
+            for k in range(nz):
+                z = 0.5 * (zfull(k) + zfull(k + 1))
+                zc = float(z.mean())
+                pres = 101325. * np.exp(-z / 7500.)
+                v["PB"][t, k] = pres
+                v["P"][t, k] = 50. * np.cos(phase + y / 9.)
+                v["T"][t, k] = 3.5e-3 * z - 10. + 2. * np.sin(phase) + 3. * anomaly * np.exp(-zc / 4000.)
+                v["QVAPOR"][t, k] = 0.016 * np.exp(-z / 2500.)
+                speed = 5. + 2.5e-3 * z
+                ustag = np.concatenate([speed, speed[:, -1:]], axis=1)
+                vstag = np.concatenate([speed, speed[-1:, :]], axis=0)
+                v["U"][t, k] = ustag + 0.5 * rng.standard_normal((ny, nx + 1)) + 5. * np.pad(anomaly, ((0, 0), (0, 1)), mode="edge")
+                v["V"][t, k] = 0.3 * vstag + 0.5 * rng.standard_normal((ny + 1, nx))
+                heating = np.exp(-((zc - 5000.) / 2500.)**2)
+                v["RTHCUTEN"][t, k] = heating * (1e-4 * (1 + anomaly) + 2e-5 * rng.standard_normal((ny, nx)))
+                v["RQVCUTEN"][t, k] = -heating * (1e-7 * (1 + anomaly) + 2e-8 * rng.standard_normal((ny, nx)))
+            v["U10"][t] = 3. + rng.standard_normal((ny, nx))
+            v["V10"][t] = 1. + rng.standard_normal((ny, nx))
+            v["T2"][t] = 300. - 6.5e-3 * hgt + 2. * np.sin(phase)
+            v["Q2"][t] = 0.016
+            v["PSFC"][t] = 101325. * np.exp(-hgt / 7500.)
+            v["LU_INDEX"][t] = np.where(hgt > 1000., 5, 14)
+            v["LANDMASK"][t] = 1
+            v["VEGFRA"][t] = 60.
+
+
+def write_met_em(path, domain, time, seed=0):
+    """Write one met_em file with the land-use fields greenfrac.py edits."""
+    rng = np.random.default_rng(seed)
+    with Dataset(path, "w", format="NETCDF4") as nc:
+        for name, size in (("Time", None), ("west_east", domain.nx), ("south_north", domain.ny),
+                           ("z-dimension0012", 12), ("z-dimension0024", 24)):
+            nc.createDimension(name, size)
+        nc.setncatts(domain.attrs(time.strftime(WRF_TIME)))
+        nc.setncattr("TITLE", "OUTPUT FROM METGRID V4.3 (synthetic)")
+        add_times(nc, [time], time)
+        lat, lon = domain.latlon()
+        dims = ("Time", "south_north", "west_east")
+        add_var(nc, "XLAT_M", dims, "Latitude on mass grid", "degrees latitude")[0] = lat
+        add_var(nc, "XLONG_M", dims, "Longitude on mass grid", "degrees longitude")[0] = lon
+        add_var(nc, "HGT_M", dims, "Topography height", "meters MSL")[0] = domain.terrain()
+        add_var(nc, "LU_INDEX", dims, "Dominant category", "category")[0] = \
+            rng.integers(1, 21, (domain.ny, domain.nx))
+        greenfrac = add_var(nc, "GREENFRAC", ("Time", "z-dimension0012", "south_north", "west_east"),
+                            "MODIS FPAR", "fraction")
+        months = np.arange(12)[:, None, None]
+        greenfrac[0] = 0.5 + 0.4 * np.sin(2 * np.pi * (months - 3) / 12.) * np.ones((domain.ny, domain.nx))
+
+
+def write_run(directory, domain, start, ntimes, interval_hours=1, seed=0, perturbation=0.):
+    """Write an hourly (or interval_hours) run, one wrfout file per time.
+
+    Returns the file paths, named wrfout_d01_YYYY-MM-DD_HH:MM:SS like WRF does.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(ntimes):
+        time = start + timedelta(hours=i * interval_hours)
+        path = os.path.join(directory, "wrfout_d01_" + time.strftime(WRF_TIME))
+        write_wrfout(path, domain, [time], start=start, seed=seed * 100003 + i, perturbation=perturbation)
+        paths.append(path)
+    return paths
+
+
+def write_met_em_run(directory, domain, start, ntimes, interval_hours=3, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(ntimes):
+        time = start + timedelta(hours=i * interval_hours)
+        path = os.path.join(directory, "met_em.d01." + time.strftime(WRF_TIME) + ".nc")
+        write_met_em(path, domain, time, seed=seed * 100003 + i)
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic control/perturbed wrfout and met_em files")
+    parser.add_argument("directory", help="output directory (control/, perturbed/ and met_em/ are created)")
+    parser.add_argument("--nx", type=int, default=100)
+    parser.add_argument("--ny", type=int, default=100)
+    parser.add_argument("--nz", type=int, default=40)
+    parser.add_argument("--times", type=int, default=3, help="number of hourly output times")
+    parser.add_argument("--start", default="2021-08-25_00:00:00", help="first valid time")
+    parser.add_argument("--met-em", type=int, default=0, help="number of 3-hourly met_em files")
+    args = parser.parse_args()
+
+    domain = Domain(args.nx, args.ny, args.nz)
+    start = datetime.strptime(args.start, WRF_TIME)
+    write_run(os.path.join(args.directory, "control"), domain, start, args.times, seed=1)
+    write_run(os.path.join(args.directory, "perturbed"), domain, start, args.times, seed=2, perturbation=1.)
+    if args.met_em:
+        write_met_em_run(os.path.join(args.directory, "met_em"), domain, start, args.met_em)
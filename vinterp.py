@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Vertical interpolation with reusable column weights.
+#
+# interplevel searches every column for the model levels bracketing the target
+# level each time it is called, so temperature at 700 hPa in two runs, or u
+# and v at the same height, repeats the same search.  A VerticalInterpolator
+# does the search once for a vertical coordinate (pressure, height, ...) and a
+# list of target levels, keeping for every column and target the upper
+# bracketing level k and the weight w on it.  Applying it to a field is then
+# two gathers and a multiply-add per target level, and any number of fields
+# can be stacked and interpolated in one call:
+#
+#   * the coordinate may carry leading dimensions, e.g. (member, bottom_top,
+#     south_north, west_east) for the control and perturbed runs at once;
+#   * fields may add more leading dimensions in front of those, e.g.
+#     (variable, member, bottom_top, south_north, west_east);
+#   * fields staggered in x or y are interpolated on the staggered points at
+#     the same levels and averaged onto the mass points, so U and V don't have
+#     to be destaggered first;
+#   * targets can be offset per column, e.g. heights above ground level with
+#     the terrain height as offset.
+#
+# Levels outside the column (below ground, above the model top) come back as
+# nan, as they do from interplevel.
+
+import numpy as np
+
+from wrfwindow import window_getvar
+
+# 1000 to 100 hPa every 50 hPa
+PRESSURE_LEVELS = np.arange(1000., 99., -50.)
+
+
+class VerticalInterpolator:
+    """Bracketing levels and weights of `levels` in the vertical coordinate `coord`.
+
+    coord is (..., bottom_top, south_north, west_east) on mass points and
+    levels a sequence of target values.  offset, if given, is added to the
+    levels in every column (shape (..., south_north, west_east)).  log=True
+    interpolates linearly in the logarithm of the coordinate, e.g. for
+    pressure.
+    """
+
+    def __init__(self, coord, levels, offset=None, log=False):
+        coord = np.asarray(coord, dtype=np.float64)
+        self.levels = np.atleast_1d(np.asarray(levels, dtype=np.float64))
+        nz, ny, nx = coord.shape[-3:]
+        self.shape = (nz, ny, nx)
+
+        targets = self.levels[:, np.newaxis, np.newaxis]
+        if offset is not None:
+            targets = targets + np.asarray(offset, dtype=np.float64)[..., np.newaxis, :, :]
+        targets = np.broadcast_to(targets, coord.shape[:-3] + (len(self.levels), ny, nx))
+        if log:
+            coord = np.log(coord)
+            targets = np.log(targets)
+        # Search in increasing order whichever way the coordinate runs
+        if coord[..., 0, :, :].mean() > coord[..., -1, :, :].mean():
+            coord = -coord
+            targets = -targets
+
+        # Number of levels below each target, one level at a time so only
+        # (..., levels, south_north, west_east) work arrays are needed
+        count = np.zeros(targets.shape, dtype=np.intp)
+        for k in range(nz):
+            count += coord[..., k:k + 1, :, :] < targets
+        self.k = np.clip(count, 1, nz - 1)
+        below = np.take_along_axis(coord, self.k - 1, axis=-3)
+        above = np.take_along_axis(coord, self.k, axis=-3)
+        self.w = (targets - below) / (above - below)
+        self.w[(count == 0) | (count == nz)] = np.nan
+
+    def gather(self, values):
+        """Interpolate values laid out on the same grid as the coordinate."""
+        lead = (1,) * (values.ndim - self.k.ndim)
+        k = self.k.reshape(lead + self.k.shape)
+        w = self.w.reshape(lead + self.w.shape)
+        lower = np.take_along_axis(values, k - 1, axis=-3)
+        upper = np.take_along_axis(values, k, axis=-3)
+        return lower + w * (upper - lower)
+
+    def __call__(self, values):
+        """values (..., bottom_top, south_north[_stag], west_east[_stag]) at every level.
+
+        Returns (..., level, south_north, west_east).
+        """
+        values = np.asarray(values)
+        nz, ny, nx = self.shape
+        if values.shape[-1] == nx + 1:
+            return 0.5 * (self.gather(values[..., :-1]) + self.gather(values[..., 1:]))
+        if values.shape[-2] == ny + 1:
+            return 0.5 * (self.gather(values[..., :-1, :]) + self.gather(values[..., 1:, :]))
+        return self.gather(values)
+
+    def apply(self, fields):
+        """Interpolate a {name: array} of fields, all fields of a shape in one pass."""
+        groups = {}
+        for name, values in fields.items():
+            groups.setdefault(np.shape(values), []).append(name)
+        result = {}
+        for names in groups.values():
+            if len(names) == 1:
+                result[names[0]] = self(fields[names[0]])
+                continue
+            stacked = self(np.stack([fields[name] for name in names]))
+            for i, name in enumerate(names):
+                result[name] = stacked[i]
+        return result
+
+
+def level_stack(ncfiles, names, levels=PRESSURE_LEVELS, coord="pressure", timeidx=0, window=None,
+                log=False):
+    """Interpolate window_getvar fields of several wrfout files to levels of coord.
+
+    The bracket search is done once for all the files, and every field of
+    every file is interpolated in one pass.  Returns {name: (file, level,
+    south_north, west_east)}.
+    """
+    def read(ncfile, name):
+        return window_getvar(ncfile, name, window, timeidx)[0]
+
+    interpolator = VerticalInterpolator(np.stack([read(ncfile, coord) for ncfile in ncfiles]), levels, log=log)
+    return interpolator.apply({name: np.stack([read(ncfile, name) for ncfile in ncfiles]) for name in names})
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Incremental plotting of a running WRF simulation.
+#
+# Instead of typing the list of timesteps into each script and plotting once
+# the run has finished, the Watcher polls the control and perturbed output
+# directories and plots each valid time as soon as both runs have finished
+# writing it:
+#
+#   shear     control, perturbed and difference 0-6 km shear (0-6kmshear.py)
+#   tempdiff  700 hPa temperature difference (sim_diff_temps.py)
+#   cross     the area-averaged time-height cross-sections (sim_cross_section.py),
+#             extended by the new times rather than recomputed
+#
+# A wrfout file counts as complete once a later file exists next to it (WRF
+# only opens the next file after closing the previous one) or once it has not
+# been modified for --settle seconds.  What has been done is kept in a JSON
+# manifest in the output directory, written after every product, together with
+# the running area averages, so a restart (after a crash, or to pick up a run
+# that is still going) carries on where it left off and never redraws a time.
+#
+# Example, polling every minute until interrupted:
+#
+#   python watch.py control/ perturbed/ --out plots/ --interval 60
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import tempfile
+import time
+import traceback
+
+from netCDF4 import Dataset
+
+from areaavg import AreaAverager, box_title
+from instrument import stage, summary
+from pairs import match_pairs
+
+PRODUCTS = ("shear", "tempdiff", "cross")
+MANIFEST = "watch_manifest.json"
+
+# Default averaging box of the cross-sections, as in sim_cross_section.py
+BOX = (32.0, -93.0, 36.0, -87.0)
+
+
+def completed_files(directory, pattern, settle):
+    """Paths of the wrfout files WRF has finished writing."""
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    now = time.time()
+    done = []
+    for i, path in enumerate(paths):
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            continue
+        if i + 1 < len(paths) or now - mtime >= settle:
+            done.append(path)
+    return done
+
+
+def write_json(path, value):
+    """Write value to path atomically, so a crash never leaves half a manifest."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f, indent=1)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def render_shear(control_path, perturbed_path, valid):
+    # the script name isn't a valid identifier, so import it by name
+    importlib.import_module("0-6kmshear").plot_shear_files(control_path, perturbed_path, valid, valid)
+
+
+def render_tempdiff(control_path, perturbed_path, valid):
+    from sim_diff_temps import plot_temp_diff
+    with Dataset(control_path) as ncfile1, Dataset(perturbed_path) as ncfile2:
+        plot_temp_diff(ncfile1, ncfile2, valid)
+
+
+RENDERERS = {"shear": render_shear, "tempdiff": render_tempdiff}
+
+
+class Watcher:
+    """Plots every new control/perturbed pair of wrfout files exactly once.
+
+    products is a subset of PRODUCTS, box the (lat1, lon1, lat2, lon2)
+    averaging box of the cross-sections.  State is kept in manifest.
+    """
+
+    def __init__(self, control_dir, perturbed_dir, products=PRODUCTS, manifest=MANIFEST,
+                 pattern="wrfout_d01_*", settle=60., box=BOX, retry_failed=False):
+        self.control_dir = control_dir
+        self.perturbed_dir = perturbed_dir
+        self.products = tuple(products)
+        self.manifest = manifest
+        self.pattern = pattern
+        self.settle = settle
+        self.box = tuple(box)
+        self.done = {product: [] for product in RENDERERS}
+        self.failed = {}
+        self.averager = None
+        self.cross_rendered = 0
+        self.load()
+        if retry_failed:
+            self.failed = {}
+
+    def load(self):
+        if not os.path.exists(self.manifest):
+            return
+        with open(self.manifest) as f:
+            state = json.load(f)
+        for product, valids in state.get("done", {}).items():
+            self.done[product] = valids
+        self.failed = state.get("failed", {})
+        if state.get("areaavg") is not None:
+            self.averager = AreaAverager.from_dict(state["areaavg"])
+        self.cross_rendered = state.get("cross_rendered", 0)
+
+    def save(self):
+        write_json(self.manifest, {
+            "control_dir": os.path.abspath(self.control_dir),
+            "perturbed_dir": os.path.abspath(self.perturbed_dir),
+            "done": self.done,
+            "failed": self.failed,
+            "areaavg": None if self.averager is None else self.averager.to_dict(),
+            "cross_rendered": self.cross_rendered,
+        })
+
+    def ready_pairs(self):
+        """[(valid, control path, perturbed path), ...] complete in both runs, by time."""
+        return match_pairs(completed_files(self.control_dir, self.pattern, self.settle),
+                           completed_files(self.perturbed_dir, self.pattern, self.settle))
+
+    def averaged_times(self):
+        if self.averager is None:
+            return set()
+        return set(str(t)[:19].replace("T", "_") for t in self.averager.times)
+
+    def poll(self):
+        """Process every pair not done yet; returns the number of products made."""
+        made = 0
+        for valid, control_path, perturbed_path in self.ready_pairs():
+            for product in self.products:
+                key = product + " " + valid
+                if product == "cross":
+                    if valid in self.averaged_times() or key in self.failed:
+                        continue
+                    ok = self.run(product, valid, self.add_average, control_path, perturbed_path)
+                else:
+                    if valid in self.done[product] or key in self.failed:
+                        continue
+                    ok = self.run(product, valid, RENDERERS[product], control_path, perturbed_path, valid)
+                    if ok:
+                        self.done[product].append(valid)
+                made += ok
+                self.save()
+        # Redraw the cross-sections once for all the times added, also when a
+        # crash came between adding the last times and drawing them
+        if self.averager is not None and self.cross_rendered != len(self.averager.times):
+            try:
+                with stage("cross", date="render"):
+                    self.render_cross_sections()
+            except Exception:
+                print("FAILED cross render\n" + traceback.format_exc())
+            else:
+                self.cross_rendered = len(self.averager.times)
+                self.save()
+        return made
+
+    def run(self, product, valid, func, *args):
+        """Call func, printing and recording a failure instead of raising it.
+
+        Failed times are not tried again unless retry_failed is given.
+        """
+        key = product + " " + valid
+        try:
+            with stage(product, date=valid):
+                func(*args)
+        except Exception:
+            self.failed[key] = traceback.format_exc()
+            print("FAILED " + key + "\n" + self.failed[key])
+            return False
+        print("done " + key)
+        return True
+
+    def add_average(self, control_path, perturbed_path):
+        if self.averager is None:
+            from wrfwindow import box_to_window
+            with Dataset(control_path) as ncfile:
+                window = box_to_window(ncfile, *self.box)
+            self.averager = AreaAverager(window, label=box_title(self.box))
+        self.averager.add_pair(control_path, perturbed_path)
+
+    def render_cross_sections(self):
+        from sim_cross_section import plot_cross_sections
+        if self.averager.label is None:
+            self.averager.label = box_title(self.box)  # manifest written before labels were kept
+        self.averager.store()
+        plot_cross_sections(self.averager)
+
+    def watch(self, interval=60., once=False):
+        """Poll until interrupted (or just once)."""
+        while True:
+            made = self.poll()
+            if once:
+                return made
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot new wrfout times as WRF writes them")
+    parser.add_argument("control_dir", help="directory the control run writes to")
+    parser.add_argument("perturbed_dir", help="directory the perturbed run writes to")
+    parser.add_argument("--out", default=".", help="directory for the plots and the manifest")
+    parser.add_argument("--products", nargs="+", choices=PRODUCTS, default=list(PRODUCTS))
+    parser.add_argument("--pattern", default="wrfout_d01_*", help="wrfout file name pattern")
+    parser.add_argument("--interval", type=float, default=60., help="seconds between polls")
+    parser.add_argument("--settle", type=float, default=60.,
+                        help="seconds without changes before the newest file counts as complete")
+    parser.add_argument("--box", type=float, nargs=4, default=BOX, metavar=("LAT1", "LON1", "LAT2", "LON2"),
+                        help="area averaging box of the cross-sections")
+    parser.add_argument("--once", action="store_true", help="poll once and exit")
+    parser.add_argument("--retry-failed", action="store_true", help="try failed times again")
+    args = parser.parse_args()
+
+    control_dir = os.path.abspath(args.control_dir)
+    perturbed_dir = os.path.abspath(args.perturbed_dir)
+    os.makedirs(args.out, exist_ok=True)
+    # the plotting functions save into the working directory
+    os.chdir(args.out)
+    watcher = Watcher(control_dir, perturbed_dir, args.products, pattern=args.pattern,
+                      settle=args.settle, box=args.box, retry_failed=args.retry_failed)
+    try:
+        watcher.watch(args.interval, args.once)
+    except KeyboardInterrupt:
+        pass
+    print(summary())
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# A long-lived worker process for many small plotting jobs.
+#
+# Running a script for one timestep or one region at a time pays the
+# interpreter start and the matplotlib/cartopy/wrf-python imports every time,
+# which for small jobs is most of the run.  `worker.py serve` pays them once:
+# it imports the libraries up front and then takes jobs over a local socket
+# (multiprocessing.connection, authenticated with a key only the user can
+# read), running them one after another in the same process.  Map templates,
+# domain geometry and map features built by one job stay loaded for the next.
+#
+# A job is a dict naming one of JOBS and its parameters:
+#
+#   shear     control, perturbed and difference bulk shear maps (layers
+#             "0-1,0-3,0-6" in km, default 0-6)
+#   tempdiff  700 hPa temperature difference maps
+#   cross     area-averaged time-height cross-sections over a lat/lon box
+#   render    plots redrawn from the product store (render_products.py)
+#
+# with an optional time range (start/end, YYYY-MM-DD_HH:MM:SS, inclusive), a
+# map extent or averaging box, and the directory to write the plots to.  The
+# product store is the worker's (./products where it was started, or
+# WRF_PRODUCTS) unless a job names its own.  The reply carries the result, or
+# the traceback of a failed job, and the stage timings recorded while it ran.
+# From the shell:
+#
+#   python worker.py serve &
+#   python worker.py submit shear --control control/ --perturbed perturbed/ \
+#       --start 2021-07-14_01:00:00 --end 2021-07-14_06:00:00 --out plots/
+#   python worker.py stop
+#
+# or from Python with submit({"job": "shear", ...}).
+
+import argparse
+import glob
+import importlib
+import os
+import secrets
+import tempfile
+import traceback
+from multiprocessing.connection import Client, Listener
+
+from instrument import PROFILER, stage, summary
+from pairs import match_pairs
+
+ADDRESS = os.environ.get("WRF_WORKER",
+                         os.path.join(tempfile.gettempdir(), "wrfworker-%d.sock" % os.getuid()))
+KEY_FILE = os.environ.get("WRF_WORKER_KEY",
+                          os.path.join(os.path.expanduser("~"), ".cache", "wrfworker.key"))
+
+# Default averaging box of the cross-sections, as in sim_cross_section.py
+BOX = (32.0, -93.0, 36.0, -87.0)
+
+
+def authkey():
+    """The key clients authenticate with, created (readable by the user only) on first use."""
+    try:
+        with open(KEY_FILE, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(KEY_FILE), exist_ok=True)
+    key = secrets.token_bytes(32)
+    fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def parse_address(address):
+    """A socket path, or host:port for TCP."""
+    if ":" in address and os.sep not in address:
+        host, port = address.rsplit(":", 1)
+        return (host, int(port))
+    return address
+
+
+def preload():
+    """Import everything the jobs need, so the first job doesn't pay for it."""
+    import matplotlib
+    matplotlib.use("Agg")
+    for name in ("matplotlib.pyplot", "cartopy.crs", "cartopy.mpl.gridliner", "netCDF4",
+                 "0-6kmshear", "sim_diff_temps", "sim_cross_section", "render_products"):
+        importlib.import_module(name)
+    try:
+        importlib.import_module("wrf")
+    except ImportError:
+        pass
+
+
+def pairs_in_range(control_dir, perturbed_dir, start=None, end=None, pattern="wrfout_d01_*"):
+    """[(valid, control path, perturbed path), ...] with start <= valid <= end."""
+    pairs = match_pairs(glob.glob(os.path.join(control_dir, pattern)),
+                        glob.glob(os.path.join(perturbed_dir, pattern)))
+    return [pair for pair in pairs
+            if (start is None or pair[0] >= start) and (end is None or pair[0] <= end)]
+
+
+def job_shear(control, perturbed, start=None, end=None, extent=None, raster=False, pattern="wrfout_d01_*",
+              layers=None):
+    from shear import parse_layers
+
+    script = importlib.import_module("0-6kmshear")
+    layers = script.layers if layers is None else parse_layers(layers)
+    done = []
+    for valid, control_path, perturbed_path in pairs_in_range(control, perturbed, start, end, pattern):
+        with stage("plot", date=valid):
+            script.plot_shear_files(control_path, perturbed_path, valid, valid, raster, extent, layers)
+        done.append(valid)
+    return done
+
+
+def job_tempdiff(control, perturbed, start=None, end=None, extent=None, raster=False, pattern="wrfout_d01_*"):
+    from pairs import prefetch
+    from sim_diff_temps import load_temp_diff, render_temp_diff
+    done = []
+    for valid, fields in prefetch(pairs_in_range(control, perturbed, start, end, pattern), load_temp_diff):
+        render_temp_diff(fields, valid, raster, extent)
+        done.append(valid)
+    return done
+
+
+def job_cross(control, perturbed, start=None, end=None, box=BOX, pattern="wrfout_d01_*"):
+    from netCDF4 import Dataset
+    from areaavg import area_average, box_title
+    from sim_cross_section import plot_cross_sections
+    from wrfwindow import box_to_window
+
+    pairs = pairs_in_range(control, perturbed, start, end, pattern)
+    if not pairs:
+        return []
+    lat1, lon1, lat2, lon2 = box
+    with Dataset(pairs[0][1]) as ncfile:
+        window = box_to_window(ncfile, lat1, lon1, lat2, lon2)
+    with stage("reduce"):
+        averages = area_average([pair[1] for pair in pairs], [pair[2] for pair in pairs], window,
+                                label=box_title(box))
+    with stage("store"):
+        averages.store()  # to the product of this box's window
+    plot_cross_sections(averages)
+    return [pair[0] for pair in pairs]
+
+
+def job_render(products=("shear", "tempdiff", "cross"), start=None, end=None, extent=None, raster=False):
+    import products as store_module
+    import render_products
+
+    done = {}
+    for product in products:
+        stored = set()
+        for source in render_products.sources(product):
+            stored.update(store_module.valid_times(source))
+        times = [valid for valid in sorted(stored)
+                 if (start is None or valid >= start) and (end is None or valid <= end)]
+        if times:
+            render_products.RENDERERS[product](times, raster, extent)
+        done[product] = times
+    return done
+
+
+JOBS = {"shear": job_shear, "tempdiff": job_tempdiff, "cross": job_cross, "render": job_render}
+
+
+def run_job(request):
+    """Run one job request in the directory (and product store) it asks for; never raises."""
+    import products
+
+    request = dict(request)
+    name = request.pop("job")
+    out = request.pop("out", None)
+    store = request.pop("store", None)
+    cwd = os.getcwd()
+    default_store = products.STORE
+    try:
+        if store is not None:
+            products.set_store(os.path.abspath(store))  # for this job only
+        if out is not None:
+            os.makedirs(out, exist_ok=True)
+            # the plotting functions save into the working directory
+            os.chdir(out)
+        with stage(name):
+            result = JOBS[name](**request)
+    except Exception:
+        return {"ok": False, "error": traceback.format_exc(), "records": PROFILER.drain()}
+    finally:
+        os.chdir(cwd)
+        products.set_store(default_store)
+    return {"ok": True, "result": result, "records": PROFILER.drain()}
+
+
+def serve(address=ADDRESS, warm=True):
+    """Take job requests on address until a "stop" request comes in."""
+    import products
+
+    # Jobs run in their own output directories, so pin a relative store
+    # (the default ./products) to where the worker was started
+    products.set_store(os.path.abspath(products.STORE))
+    address = parse_address(address)
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)  # left behind by a worker that was killed
+    if warm:
+        with stage("preload"):
+            preload()
+        PROFILER.drain()
+    listener = Listener(address, authkey=authkey())
+    print("worker listening on %s" % (address,))
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception:
+                traceback.print_exc()  # e.g. a client with the wrong key
+                continue
+            with conn:
+                while True:
+                    try:
+                        request = conn.recv()
+                    except EOFError:
+                        break
+                    if request.get("job") == "stop":
+                        conn.send({"ok": True, "result": "stopped", "records": []})
+                        return
+                    conn.send(run_job(request))
+    finally:
+        listener.close()
+
+
+def submit(request, address=ADDRESS):
+    """Send one job request to a running worker and wait for the reply."""
+    with Client(parse_address(address), authkey=authkey()) as conn:
+        conn.send(request)
+        return conn.recv()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm worker process for plotting jobs")
+    parser.add_argument("--address", default=ADDRESS, help="socket path or host:port (default: WRF_WORKER)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("serve", help="start a worker")
+    commands.add_parser("stop", help="stop a running worker")
+    job = commands.add_parser("submit", help="send a job to a running worker")
+    job.add_argument("job", choices=sorted(JOBS))
+    job.add_argument("--control", help="control run directory")
+    job.add_argument("--perturbed", help="perturbed run directory")
+    job.add_argument("--start", help="first valid time, YYYY-MM-DD_HH:MM:SS")
+    job.add_argument("--end", help="last valid time, YYYY-MM-DD_HH:MM:SS")
+    job.add_argument("--extent", type=float, nargs=4, metavar=("LON0", "LON1", "LAT0", "LAT1"),
+                     help="map extent (shear, tempdiff, render)")
+    job.add_argument("--box", type=float, nargs=4, metavar=("LAT1", "LON1", "LAT2", "LON2"),
+                     help="averaging box (cross)")
+    job.add_argument("--layers", help="shear layers in km, e.g. 0-1,0-3,0-6 (shear)")
+    job.add_argument("--products", nargs="+", help="products to redraw (render)")
+    job.add_argument("--store", help="product store directory (default: the worker's)")
+    job.add_argument("--raster", action="store_true", help="draw grid cells instead of filled contours")
+    job.add_argument("--out", default=".", help="directory for the plots")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.address)
+    elif args.command == "stop":
+        print(submit({"job": "stop"}, args.address)["result"])
+    else:
+        request = {"job": args.job, "out": os.path.abspath(args.out), "start": args.start, "end": args.end}
+        if args.store is not None:
+            request["store"] = os.path.abspath(args.store)
+        if args.job == "render":
+            request.update(raster=args.raster, extent=args.extent)
+            if args.products:
+                request["products"] = args.products
+        else:
+            request.update(control=os.path.abspath(args.control), perturbed=os.path.abspath(args.perturbed))
+            if args.job == "cross":
+                if args.box:
+                    request["box"] = args.box
+            else:
+                request.update(raster=args.raster, extent=args.extent)
+                if args.job == "shear" and args.layers:
+                    request["layers"] = args.layers
+        reply = submit(request, args.address)
+        if reply["ok"]:
+            print(reply["result"])
+        else:
+            print("FAILED\n" + reply["error"])
+        print(summary(reply["records"]))
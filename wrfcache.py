@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# On-disk cache for derived WRF fields.
+#
+# getvar has to read, destagger and diagnose every time it is called, which is
+# most of the runtime when all we have changed is a colormap or a title.  This
+# module keeps the computed fields in compressed pickle files, keyed by the
+# wrfout path(s), their modification times, the variable name and any extra
+# parameters, so a re-plot can skip the recompute entirely.  Touching a wrfout
+# file (e.g. rerunning the model) changes its mtime and so invalidates every
+# entry derived from it.
+#
+# The cache directory is capped in size; when it grows past the cap the least
+# recently used entries are removed first.
+#
+# Location and size cap can be changed with the WRF_CACHE_DIR and
+# WRF_CACHE_MAX_MB environment variables, or by calling set_cache().
+
+import gzip
+import hashlib
+import os
+import pickle
+import tempfile
+
+CACHE_DIR = os.environ.get("WRF_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "wrfcache"))
+MAX_BYTES = int(float(os.environ.get("WRF_CACHE_MAX_MB", 2048)) * 1024**2)
+SUFFIX = ".pkl.gz"
+
+
+def set_cache(directory=None, max_mb=None):
+    """Change the cache directory and/or size cap for this process."""
+    global CACHE_DIR, MAX_BYTES
+    if directory is not None:
+        CACHE_DIR = directory
+    if max_mb is not None:
+        MAX_BYTES = int(max_mb * 1024**2)
+
+
+def source_files(wrfin):
+    """Return [(path, mtime), ...] for a Dataset, a path, or a list of either."""
+    if isinstance(wrfin, (list, tuple)):
+        files = []
+        for item in wrfin:
+            files.extend(source_files(item))
+        return files
+    path = wrfin if isinstance(wrfin, str) else wrfin.filepath()
+    path = os.path.abspath(path)
+    return [(path, os.stat(path).st_mtime_ns)]
+
+
+def cache_key(wrfin, name, **params):
+    """Hash the source files, their mtimes, the field name and parameters."""
+    parts = [repr(source_files(wrfin)), name]
+    parts.extend(key + "=" + repr(params[key]) for key in sorted(params))
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def cached(wrfin, name, compute, **params):
+    """Return compute(), reusing a stored result for the same inputs.
+
+    wrfin is whatever the result was derived from (Dataset, path or list of
+    either) and name/params describe how; together they make up the key.
+    """
+    path = os.path.join(CACHE_DIR, cache_key(wrfin, name, **params) + SUFFIX)
+    try:
+        with gzip.open(path, "rb") as f:
+            value = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        # missing, evicted by another process, or half written by a crash
+        pass
+    else:
+        try:
+            os.utime(path)  # mark as recently used for the LRU eviction
+        except OSError:
+            pass
+        return value
+
+    value = compute()
+    store(path, value)
+    evict()
+    return value
+
+
+def cached_getvar(wrfin, varname, **kwargs):
+    """Drop-in replacement for wrf.getvar backed by the on-disk cache."""
+    from wrf import getvar
+    return cached(wrfin, "getvar:" + varname,
+                  lambda: getvar(wrfin, varname, **kwargs), **kwargs)
+
+
+def store(path, value):
+    """Write value to path atomically so parallel workers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=4) as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def entries():
+    """Return [(mtime, size, path), ...] for every cache entry, oldest first."""
+    found = []
+    try:
+        names = os.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        return found
+    for entry in names:
+        if not entry.endswith(SUFFIX):
+            continue
+        path = os.path.join(CACHE_DIR, entry)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        found.append((st.st_mtime, st.st_size, path))
+    found.sort()
+    return found
+
+
+def evict(max_bytes=None):
+    """Remove least recently used entries until the cache fits in max_bytes."""
+    if max_bytes is None:
+        max_bytes = MAX_BYTES
+    found = entries()
+    total = sum(size for _, size, _ in found)
+    for _, size, path in found:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+
+def clear():
+    """Remove every cache entry."""
+    evict(0)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Windowed (hyperslab) reads of WRF output.
+#
+# getvar always reads and diagnoses the full domain, so an area average over a
+# few hundred kilometres still pays for the whole WRF grid.  The functions here
+# convert a lat/lon box to grid indices first, read only that hyperslab (plus
+# the one extra point a staggered variable needs) straight from the netCDF
+# variables, and compute the few diagnostics we use on the subset alone.  I/O
+# and memory then scale with the size of the box.
+#
+# Arrays come back as plain numpy arrays that keep the Time dimension:
+# (Time, bottom_top, south_north, west_east) for 3-D fields.
+
+import numpy as np
+from netCDF4 import chartostring
+
+# Constants as used by wrf-python for the pressure/temperature diagnostics
+P0 = 100000.          # reference pressure (Pa)
+T_BASE = 300.         # base state potential temperature (K)
+RD = 287.
+CP = 1004.5
+G = 9.81
+
+# Horizontal dimension names, mass and staggered
+X_DIMS = ("west_east", "west_east_stag")
+Y_DIMS = ("south_north", "south_north_stag")
+
+
+def box_to_window(wrfin, lat1, lon1, lat2, lon2):
+    """Convert a lat/lon box to an inclusive grid window (x1, x2, y1, y2).
+
+    (lat1, lon1) and (lat2, lon2) are opposite corners of the box.  The window
+    matches .sel(south_north=slice(y1, y2), west_east=slice(x1, x2)) on a
+    getvar result.
+    """
+    from wrf import to_np, ll_to_xy
+    xa, ya = to_np(ll_to_xy(wrfin, lat1, lon1))
+    xb, yb = to_np(ll_to_xy(wrfin, lat2, lon2))
+    return (int(min(xa, xb)), int(max(xa, xb)), int(min(ya, yb)), int(max(ya, yb)))
+
+
+def window_slices(dims, window, timeidx=slice(None)):
+    """Build the index tuple reading `window` out of a variable with `dims`.
+
+    Staggered horizontal dimensions get one extra point so the subset can be
+    destaggered back onto the mass points of the window.  window=None reads
+    the whole domain.
+    """
+    index = []
+    for dim in dims:
+        if dim == "Time":
+            index.append(timeidx)
+        elif window is None:
+            index.append(slice(None))
+        elif dim in X_DIMS:
+            x1, x2 = window[:2]
+            index.append(slice(x1, x2 + 1 + (dim == "west_east_stag")))
+        elif dim in Y_DIMS:
+            y1, y2 = window[2:]
+            index.append(slice(y1, y2 + 1 + (dim == "south_north_stag")))
+        else:
+            index.append(slice(None))
+    return tuple(index)
+
+
+def destagger(values, axis):
+    """Average neighbouring points along a staggered axis onto the mass points."""
+    values = np.asarray(values)
+    n = values.shape[axis]
+    lower = np.take(values, np.arange(n - 1), axis=axis)
+    upper = np.take(values, np.arange(1, n), axis=axis)
+    return 0.5 * (lower + upper)
+
+
+def read_raw(ncfile, varname, window, timeidx=slice(None)):
+    """Read a raw variable over the window, keeping any staggered halo.
+
+    Returns (values, dims) with the Time dimension kept even for an integer
+    timeidx.
+    """
+    var = ncfile.variables[varname]
+    dims = var.dimensions
+    values = np.asarray(var[window_slices(dims, window, timeidx)], dtype=np.float64)
+    if isinstance(timeidx, (int, np.integer)) and "Time" in dims:
+        values = values[np.newaxis]
+    return values, dims
+
+
+def read_window(ncfile, varname, window, timeidx=slice(None)):
+    """Read a raw variable over the window, destaggered onto mass points."""
+    values, dims = read_raw(ncfile, varname, window, timeidx)
+    for axis, dim in enumerate(dims):
+        if dim.endswith("_stag"):
+            values = destagger(values, axis)
+    return values
+
+
+def window_getvar(ncfile, name, window, timeidx=slice(None)):
+    """getvar-style diagnostics computed only over the window.
+
+    Supports "pressure" (hPa), "theta" (K), "tk" (K), "tc" (degC), "z" (m),
+    "ter" (m), "ua"/"va" (m/s, grid relative) and any raw variable in the file.
+    """
+    def read(varname):
+        return read_window(ncfile, varname, window, timeidx)
+
+    if name in ("pressure", "tk", "tc"):
+        pres = read("P") + read("PB")
+        if name == "pressure":
+            return pres * 0.01
+        tk = (read("T") + T_BASE) * (pres / P0) ** (RD / CP)
+        return tk - 273.15 if name == "tc" else tk
+    if name == "theta":
+        return read("T") + T_BASE
+    if name == "z":
+        return (read("PH") + read("PHB")) / G
+    if name == "ter":
+        return read("HGT")
+    if name == "ua":
+        return read("U")
+    if name == "va":
+        return read("V")
+    return read(name)
+
+
+def extract_times(ncfile, timeidx=slice(None)):
+    """Valid times of a wrfout file as numpy datetime64 values."""
+    times = chartostring(ncfile.variables["Times"][timeidx])
+    return np.array([str(t).replace("_", "T") for t in np.atleast_1d(times)],
+                    dtype="datetime64[ns]")